@@ -0,0 +1,106 @@
+import re
+import string
+
+FIELDS = ("n", "orig", "ext", "size")
+
+
+def is_template(text):
+    """Whether a name entered by the user is a batch template rather than a plain name.
+
+    Names that merely contain braces, like `Movie {2020}`, are plain names; with the
+    explicit `<regex> => <template>` form, errors are reported instead.
+    """
+    if "=>" in text:
+        return True
+    try:
+        parse_batch_command(text)
+    except ValueError:
+        return False
+    return any(field is not None for _, field, _, _ in string.Formatter().parse(text))
+
+
+class Capture(str):
+    """A regex capture; all-digit captures take numeric format specs, so {1:03} pads with zeros."""
+
+    def __format__(self, spec):
+        if spec and self.isdigit():
+            try:
+                return format(int(self), spec)
+            except ValueError:
+                pass
+        return super().__format__(spec)
+
+
+class BatchTemplate:
+    """A rename template applied to every file of a batch.
+
+    Placeholders: {n} running number (format specs such as {n:03} work), {orig} original
+    name without extension, {ext} original extension without the dot, {size} file size,
+    and {1}, {2}, ... or {name} for capture groups of the optional regex, which is
+    searched in the original filename. Numeric captures format like numbers ({1:03}),
+    and {{ and }} give literal braces.
+    """
+
+    def __init__(self, template, pattern=None, start=1):
+        self.template = template
+        try:
+            self.pattern = re.compile(pattern) if pattern else None
+        except re.error as e:
+            raise ValueError(f"Invalid regex: {e}")
+        self.counter = start
+        self._validate()
+
+    def _validate(self):
+        groups = self.pattern.groups if self.pattern else 0
+        named = self.pattern.groupindex if self.pattern else {}
+        try:
+            parsed = list(string.Formatter().parse(self.template))
+        except ValueError as e:
+            raise ValueError(f"Invalid template: {e}")
+        for _, field, _, _ in parsed:
+            if field is None:
+                continue
+            name = re.split(r"[.\[]", field, 1)[0]
+            if not name:
+                raise ValueError("Empty placeholder {} is not allowed, use {n} or {1}")
+            if name.isdigit():
+                if int(name) > groups:
+                    raise ValueError(f"Template uses group {{{name}}} but the regex has {groups} group(s)")
+            elif name not in FIELDS and name not in named:
+                raise ValueError(f"Unknown placeholder {{{field}}}")
+
+    def render(self, original_name, size="", n=None):
+        """Render the template for one file. Uses the running counter if n is None and
+        advances it once the file was named."""
+        advance = n is None
+        if advance:
+            n = self.counter
+
+        base, dot, ext = original_name.rpartition(".")
+        if not dot:
+            base, ext = original_name, ""
+        fields = {"n": n, "orig": base, "ext": ext, "size": size}
+
+        groups = ()
+        if self.pattern:
+            match = self.pattern.search(original_name)
+            if not match:
+                raise ValueError(f"Regex does not match `{original_name}`")
+            groups = tuple(Capture(g or "") for g in (match.group(0),) + match.groups())
+            fields.update({k: Capture(v or "") for k, v in match.groupdict().items()})
+
+        try:
+            name = self.template.format(*groups, **fields)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Could not render template: {e}")
+        if advance:
+            self.counter += 1
+        return name
+
+
+def parse_batch_command(text):
+    """Parse `<template>` or `<regex> => <template>` from a /batch command."""
+    if "=>" in text:
+        pattern, template = text.split("=>", 1)
+        return BatchTemplate(template.strip(), pattern.strip())
+    return BatchTemplate(text.strip())
@@ -0,0 +1,188 @@
+import os
+import time
+import random
+import asyncio
+from collections import Counter
+from pyrogram import raw
+from pyrogram.errors import FloodWait
+from pyrogram.file_id import FileId, FileType
+
+CHUNK_SIZE = 1024 * 1024
+_ZEROS = bytes(CHUNK_SIZE)
+
+
+class FakeStorage:
+    def __init__(self, dc_id):
+        self._dc_id = dc_id
+
+    async def dc_id(self):
+        return self._dc_id
+
+    async def test_mode(self):
+        return False
+
+
+class FakeParser:
+    async def parse(self, text, mode=None):
+        return {"message": text, "entities": None}
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeMessage:
+    """Just enough of pyrogram's Message for status replies and edits."""
+
+    def __init__(self, client, chat_id, message_id, text=""):
+        self._client = client
+        self.chat = FakeChat(chat_id)
+        self.id = message_id
+        self.text = text
+
+    async def edit_text(self, text, **kwargs):
+        await self._client.edit(self, text)
+        return self
+
+    async def reply_text(self, text, **kwargs):
+        return await self._client.send_message(self.chat.id, text)
+
+
+class FakeClient:
+    """In-process stand-in for the pyrogram Client used by the rename pipeline.
+
+    Every transfer call sleeps for `latency` plus its size over `bandwidth` (bytes/s
+    per connection), and fails with a FloodWait of `flood_wait` seconds with
+    probability `flood_rate` (`edit_flood_rate` for status edits). Downloaded files
+    are all zeros, uploaded parts are only counted.
+    """
+
+    def __init__(self, bandwidth=50 * 1024 * 1024, latency=0.05, flood_rate=0.0,
+                 edit_flood_rate=0.0, flood_wait=1, dc_id=2, seed=0):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.edit_flood_rate = edit_flood_rate
+        self.flood_wait = flood_wait
+        self.storage = FakeStorage(dc_id)
+        self.parser = FakeParser()
+        self.is_connected = True
+        self.calls = Counter()
+        self.flood_waits = Counter()
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+        self.edits = 0
+        self.sent = []
+        self._files = {}
+        self._media = {}
+        self._message_ids = iter(range(1, 1 << 62))
+        self._rng = random.Random(seed)
+
+    def rnd_id(self):
+        return self._rng.getrandbits(63)
+
+    def add_file(self, size, file_type=FileType.DOCUMENT):
+        """Register a remote file of `size` bytes and return its file_id."""
+        media_id = self.rnd_id()
+        file_id = FileId(
+            file_type=file_type,
+            dc_id=self.storage._dc_id,
+            media_id=media_id,
+            access_hash=self.rnd_id(),
+            file_reference=b""
+        ).encode()
+        self._files[file_id] = size
+        self._media[media_id] = size
+        return file_id
+
+    def _maybe_flood(self, method, rate):
+        if rate and self._rng.random() < rate:
+            self.flood_waits[method] += 1
+            raise FloodWait(value=self.flood_wait)
+
+    async def _transfer(self, method, size=0):
+        self.calls[method] += 1
+        self._maybe_flood(method, self.flood_rate)
+        await asyncio.sleep(self.latency + size / self.bandwidth)
+
+    async def stream_media(self, message, limit=0, offset=0):
+        size = self._files[message]
+        chunks = (size + CHUNK_SIZE - 1) // CHUNK_SIZE
+        end = min(chunks, offset + limit) if limit else chunks
+        for chunk in range(offset, end):
+            length = min(CHUNK_SIZE, size - chunk * CHUNK_SIZE)
+            await self._transfer("stream_media", length)
+            self.bytes_downloaded += length
+            yield _ZEROS[:length]
+
+    async def download_media(self, message, file_name="downloads/", **kwargs):
+        size = self._files.get(message, 64 * 1024)
+        await self._transfer("download_media", size)
+        self.bytes_downloaded += size
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        with open(file_name, "wb") as f:
+            f.write(bytes(size))
+        return file_name
+
+    async def save_file(self, path, **kwargs):
+        size = os.path.getsize(path)
+        await self._transfer("save_file", size)
+        self.bytes_uploaded += size
+        return raw.types.InputFile(id=self.rnd_id(), parts=1, name=os.path.basename(path), md5_checksum="")
+
+    async def resolve_peer(self, peer_id):
+        return raw.types.InputPeerUser(user_id=peer_id, access_hash=0)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls["send_message"] += 1
+        return FakeMessage(self, chat_id, next(self._message_ids), text)
+
+    async def edit(self, message, text):
+        self.calls["edit_message_text"] += 1
+        self._maybe_flood("edit_message_text", self.edit_flood_rate)
+        await asyncio.sleep(self.latency)
+        self.edits += 1
+        message.text = text
+
+    async def invoke(self, query, **kwargs):
+        method = type(query).__name__
+        if isinstance(query, (raw.functions.upload.SaveFilePart, raw.functions.upload.SaveBigFilePart)):
+            await self._transfer(method, len(query.bytes))
+            self.bytes_uploaded += len(query.bytes)
+            return True
+        if isinstance(query, raw.functions.upload.GetFile):
+            size = self._media.get(query.location.id, 0)
+            length = max(0, min(query.limit, size - query.offset))
+            await self._transfer(method, length)
+            self.bytes_downloaded += length
+            return raw.types.upload.File(type=raw.types.storage.FileUnknown(), mtime=0, bytes=_ZEROS[:length])
+        if isinstance(query, raw.functions.messages.SendMedia):
+            await self._transfer(method)
+            self.sent.append(query)
+            return raw.types.Updates(updates=[], users=[], chats=[], date=int(time.time()), seq=0)
+        if isinstance(query, raw.functions.Ping):
+            return raw.types.Pong(msg_id=0, ping_id=query.ping_id)
+        raise NotImplementedError(f"FakeClient does not simulate {method}")
+
+
+class FakeSession:
+    def __init__(self, client):
+        self.client = client
+
+    async def invoke(self, query, **kwargs):
+        return await self.client.invoke(query, **kwargs)
+
+
+class FakeSessionPool:
+    """MediaSessionPool replacement; each session gets the full per-connection bandwidth."""
+
+    def __init__(self, client, size=4):
+        self.client = client
+        self.size = size
+
+    async def get(self, dc_id, count=None):
+        return [FakeSession(self.client) for _ in range(min(count or self.size, self.size))]
+
+    async def stop(self):
+        pass
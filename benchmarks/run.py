@@ -0,0 +1,213 @@
+"""Benchmark the rename pipeline against the in-process fake Telegram backend.
+
+    python benchmarks/run.py                          # every scenario
+    python benchmarks/run.py --scenario many_small --output before.json
+    python benchmarks/run.py --scale 0.1 --bandwidth 20 --flood-rate 0.01
+
+Each scenario runs in its own process so peak RSS is measured per scenario. The
+bot's own settings (STREAM_MODE, DOWNLOAD_CONNECTIONS, WORKERS, EDIT_INTERVAL, ...)
+are read from the environment as usual.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+SCENARIOS = {
+    "single_large": {"users": 1, "files_per_user": 1, "file_size": 2048 * MB},
+    "many_small": {"users": 1, "files_per_user": 100, "file_size": 10 * MB},
+    "concurrent_users": {"users": 20, "files_per_user": 5, "file_size": 20 * MB},
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (MB if sys.platform == "darwin" else 1024), 1)
+
+
+def load_bot(workdir):
+    """Import bot.py with dummy credentials and in-memory state, writing files under `workdir`."""
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "benchmark")
+    os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+    os.environ.setdefault("ADMIN_ID", "1")
+    os.environ.setdefault("STATE_DB", "memory://")
+    os.environ.setdefault("MEDIA_PROBE", "false")
+    os.chdir(os.path.abspath(workdir))
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bot
+    return bot
+
+
+async def run_scenario(name, spec, args):
+    from fake_client import FakeClient, FakeSessionPool
+
+    bot = load_bot(args.workdir)
+    from job_queue import JobScheduler
+    from progress import ProgressRenderer
+    from client_pool import ClientPool
+
+    client = FakeClient(
+        bandwidth=args.bandwidth * MB,
+        latency=args.latency,
+        flood_rate=args.flood_rate,
+        edit_flood_rate=args.edit_flood_rate,
+        flood_wait=args.flood_wait,
+        seed=args.seed
+    )
+    file_size = max(1, int(spec["file_size"] * args.scale))
+    total_jobs = spec["users"] * spec["files_per_user"]
+    latencies = []
+    outcomes = {}
+    finished = asyncio.Event()
+
+    def on_done(job):
+        latencies.append(time.time() - job.created_at)
+        outcomes[job.status] = outcomes.get(job.status, 0) + 1
+        if len(latencies) == total_jobs:
+            finished.set()
+
+    # The pipeline looks these up as module globals, so swapping them is enough
+    bot.app = client
+    bot.client_pool = ClientPool(
+        client, FakeSessionPool(client, size=max(bot.DOWNLOAD_CONNECTIONS, bot.UPLOAD_CONNECTIONS))
+    )
+    bot.progress_renderer = ProgressRenderer(chat_interval=bot.EDIT_INTERVAL, global_rate=bot.EDIT_RATE)
+    bot.scheduler = JobScheduler(
+        lambda job: bot.process_file(client, job),
+        workers=bot.WORKERS,
+        max_transmissions=bot.MAX_TRANSMISSIONS,
+        on_done=on_done
+    )
+
+    bot.progress_renderer.start()
+    bot.scheduler.start()
+    started = time.time()
+    for n in range(spec["files_per_user"]):
+        for user_id in range(1, spec["users"] + 1):
+            task = {
+                "file_id": client.add_file(file_size),
+                "file_unique_id": f"bench{user_id}_{n}",
+                "file_type": "document",
+                "message_id": n,
+                "file_size": file_size,
+                "original_filename": f"file_{user_id}_{n}.bin",
+                "new_name": f"renamed_{user_id}_{n}.bin",
+                "media_meta": {"mime_type": "application/octet-stream"}
+            }
+            task["work_id"] = f"{user_id}_{task['file_unique_id']}"
+            status_message = await client.send_message(user_id, "Queued...")
+            bot.scheduler.submit(user_id, task, status_message)
+
+    await finished.wait()
+    elapsed = time.time() - started
+    await bot.scheduler.stop()
+    await bot.progress_renderer.stop()
+
+    return {
+        "scenario": name,
+        "jobs": total_jobs,
+        "file_size": file_size,
+        "outcomes": outcomes,
+        "sent": len(client.sent),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_mb_s": round(total_jobs * file_size / MB / elapsed, 2),
+        "latency_p50_s": round(percentile(latencies, 50), 3),
+        "latency_p99_s": round(percentile(latencies, 99), 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "status_edits": client.edits,
+        "frames_dropped": bot.progress_renderer.frames_dropped,
+        "flood_waits": dict(client.flood_waits),
+        "calls": dict(client.calls),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _drop_option_values(argv, options):
+    """Remove `options` (as `--opt value` or `--opt=value`) from an argument list."""
+    kept = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in options:
+            skip = True
+        elif not any(arg.startswith(opt + "=") for opt in options):
+            kept.append(arg)
+    return kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS) + ["all"], default="all")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every file size by this factor")
+    parser.add_argument("--bandwidth", type=float, default=50, help="MB/s per connection")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every request")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="chance of a FloodWait per transfer request")
+    parser.add_argument("--edit-flood-rate", type=float, default=0.0, help="chance of a FloodWait per status edit")
+    parser.add_argument("--flood-wait", type=int, default=1, help="seconds of every injected FloodWait")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="directory for downloads (default: a temporary one)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.scenario != "all":
+        # The bot prints its own log lines; keep stdout for the report
+        with tempfile.TemporaryDirectory(prefix="renamer-bench-") as tmp, redirect_stdout(sys.stderr):
+            args.workdir = args.workdir or tmp
+            result = asyncio.run(run_scenario(args.scenario, SCENARIOS[args.scenario], args))
+        report = [result]
+    else:
+        # One process per scenario so peak RSS and module state do not carry over
+        report = []
+        passthrough = _drop_option_values(sys.argv[1:], ("--scenario", "--output"))
+        for name in SCENARIOS:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--scenario", name] + passthrough,
+                capture_output=True, text=True, check=True
+            ).stdout
+            report.extend(json.loads(out)["results"])
+
+    data = json.dumps({
+        "revision": git_revision(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "workdir")},
+        "results": report
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,33 @@
 import os
+import re
 import time
 import asyncio
-import shutil
 import json
 from dotenv import load_dotenv
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle, raw
 from pyrogram.types import Message, ForceReply, InlineKeyboardButton, InlineKeyboardMarkup
-from pyrogram.errors import BadRequest, FloodWait
-from flask import Flask
-from threading import Thread
+from pyrogram.errors import BadRequest, FloodWait, FilePartMissing, InternalServerError
 import math
+from transfer import (
+    stream_rename, memory_rename, split_rename, join_rename, resumable_download, parallel_download, upload_file, send_uploaded_media,
+    MediaSessionPool, CdnRedirected, STREAM_CHUNK_SIZE
+)
+from workspace import Workspace, WorkspaceJanitor
+from disk_space import DiskReservations
+from file_cache import SentFileCache, SourceCache, sent_file_id
+from state_store import open_state_store
+from web_server import WebServer
+from metrics import REGISTRY, STAGE_SECONDS, ERRORS, JOBS, timed, record_flood_wait
+from job_queue import JobScheduler
+from batch import is_template, parse_batch_command, BatchTemplate
+from rename_rules import INVALID_CHARS, sanitize_filename, split_extension, compile_preset
+from zip_members import rename_members
+from thumb_cache import ThumbnailCache
+from helper_fns import get_media_meta
+from media_inspector import MediaInspector, RetagError, stream_format
+from client_pool import ClientPool
+from worker_pool import WorkerPool
+from progress import ProgressRenderer
 
 # --- Load Environment Variables ---
 load_dotenv()
@@ -20,6 +38,79 @@ BOT_TOKEN = os.environ.get("BOT_TOKEN")
 ADMIN_ID = os.environ.get("ADMIN_ID")
 PORT = int(os.environ.get("PORT", 5000))
 
+# Streaming mode uploads while downloading instead of doing a full disk round-trip
+STREAM_MODE = os.environ.get("STREAM_MODE", "false").lower() == "true"
+STREAM_BUFFER_MB = int(os.environ.get("STREAM_BUFFER_MB", 64))
+# Files up to this size (MB) are renamed entirely in memory, without touching the disk
+MEMORY_RENAME_MB = float(os.environ.get("MEMORY_RENAME_MB", 5))
+# Largest file the account can upload (2000 MB for bots); larger files are streamed as
+# numbered parts of SPLIT_PART_MB, or refused on receipt when SPLIT_LARGE_FILES is off
+UPLOAD_LIMIT_MB = int(os.environ.get("UPLOAD_LIMIT_MB", 2000))
+SPLIT_LARGE_FILES = os.environ.get("SPLIT_LARGE_FILES", "true").lower() == "true"
+SPLIT_PART_MB = min(int(os.environ.get("SPLIT_PART_MB", UPLOAD_LIMIT_MB)), UPLOAD_LIMIT_MB)
+
+# Parallel connections used to download one file (1 = sequential download)
+DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", 4))
+# Parallel connections used to upload one file (1 = main session only)
+UPLOAD_CONNECTIONS = int(os.environ.get("UPLOAD_CONNECTIONS", 4))
+
+# Helper clients that share the transfer work with the main bot: comma-separated bot tokens
+# and/or session strings. Files reach them through HELPER_CHANNEL, where they must be admins.
+HELPER_BOT_TOKENS = [t.strip() for t in os.environ.get("HELPER_BOT_TOKENS", "").split(",") if t.strip()]
+HELPER_SESSIONS = [s.strip() for s in os.environ.get("HELPER_SESSIONS", "").split(",") if s.strip()]
+HELPER_CHANNEL = int(os.environ.get("HELPER_CHANNEL", 0))
+
+# Worker processes that run the transfers, each with its own session (0 = all in this process)
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", 0))
+# Set by worker.py inside a worker process
+WORKER_INDEX = os.environ.get("WORKER_INDEX")
+
+def process_dir(directory):
+    """Directory of a cache for this process: a cache only knows which of its own files are in use,
+    so every worker process evicts from a directory of its own"""
+    return os.path.join(directory, f"w{WORKER_INDEX}") if WORKER_INDEX else directory
+
+# Job queue: number of parallel rename jobs and global cap on running transfers
+WORKERS = int(os.environ.get("WORKERS", 4))
+MAX_TRANSMISSIONS = int(os.environ.get("MAX_TRANSMISSIONS", 4))
+# Transfer speed assumed when estimating job run times, so smaller jobs can be started first
+SCHEDULE_SPEED_MB = float(os.environ.get("SCHEDULE_SPEED_MB", 10))
+
+# Number of custom thumbnails kept on disk besides the permanent one
+THUMB_CACHE_SIZE = int(os.environ.get("THUMB_CACHE_SIZE", 32))
+
+# ffprobe/ffmpeg inspection of downloaded files for missing metadata and thumbnails
+MEDIA_PROBE = os.environ.get("MEDIA_PROBE", "true").lower() == "true"
+PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", 2))
+# Write the new name into the title tag of renamed videos/audios (ffmpeg stream copy, never re-encoded);
+# tags given as title:/artist: in the rename reply are written either way
+RETAG_MEDIA = os.environ.get("RETAG_MEDIA", "false").lower() == "true"
+
+# Status message edit pacing: seconds between edits per chat, edits per second overall
+EDIT_INTERVAL = float(os.environ.get("EDIT_INTERVAL", 3))
+EDIT_RATE = float(os.environ.get("EDIT_RATE", 20))
+
+# How often a job is resumed after a FloodWait or network error before it fails
+MAX_RETRIES = int(os.environ.get("MAX_RETRIES", 5))
+
+# Per-job workspaces live below this directory; orphans left by crashes are removed by a janitor
+DOWNLOAD_DIR = os.environ.get("DOWNLOAD_DIR", "downloads")
+# Disk cap for DOWNLOAD_DIR in MB (0 = no cap); above it orphaned workspaces are removed right away
+DOWNLOAD_DISK_CAP_MB = int(os.environ.get("DOWNLOAD_DISK_CAP_MB", 0))
+# Free space in MB always left on the download disk; jobs wait in the queue until they fit
+DISK_HEADROOM_MB = int(os.environ.get("DISK_HEADROOM_MB", 100))
+
+# Earlier uploads resent by file_id when the same file gets the same name and thumbnail again
+SENT_CACHE_SIZE = int(os.environ.get("SENT_CACHE_SIZE", 1000))
+# Optional hardlinked copies of downloaded sources (MB, 0 = off) so a second rename skips the download;
+# SOURCE_CACHE_DIR must be on the same filesystem as DOWNLOAD_DIR
+SOURCE_CACHE_MB = int(os.environ.get("SOURCE_CACHE_MB", 0))
+SOURCE_CACHE_TTL = int(os.environ.get("SOURCE_CACHE_TTL", 3600))
+SOURCE_CACHE_DIR = os.environ.get("SOURCE_CACHE_DIR", "source_cache")
+
+# Where conversation state and queued jobs are kept across restarts (sqlite:///path or memory://)
+STATE_DB = os.environ.get("STATE_DB", "sqlite:///bot_state.db")
+
 # --- Bot Initialization ---
 if not all([API_ID, API_HASH, BOT_TOKEN, ADMIN_ID]):
     raise ValueError("Missing one or more required environment variables: API_ID, API_HASH, BOT_TOKEN, ADMIN_ID")
@@ -29,64 +120,238 @@ try:
 except ValueError:
     raise ValueError("ADMIN_ID must be a valid integer.")
 
+if (HELPER_BOT_TOKENS or HELPER_SESSIONS) and not HELPER_CHANNEL:
+    raise ValueError("HELPER_CHANNEL is required when helper clients are configured")
+
 # Simple configuration - remove advanced options that might cause issues
 app = Client(
     "file_renamer_bot",
     api_id=API_ID,
     api_hash=API_HASH,
-    bot_token=BOT_TOKEN
+    bot_token=BOT_TOKEN,
+    max_concurrent_transmissions=MAX_TRANSMISSIONS
 )
 
-# --- Simple Flask Web Server ---
-web_app = Flask(__name__)
+# Extra media sessions for parallel range downloads and part uploads
+media_sessions = MediaSessionPool(app, size=max(DOWNLOAD_CONNECTIONS, UPLOAD_CONNECTIONS))
+
+# Helper clients only transfer files; the main client keeps handling the chat
+def make_helper_clients(tag=""):
+    """One Client per helper token/session; `tag` keeps session files of worker processes apart"""
+    return [
+        Client(
+            f"helper_{n}{tag}",
+            api_id=API_ID,
+            api_hash=API_HASH,
+            bot_token=token,
+            no_updates=True,
+            max_concurrent_transmissions=MAX_TRANSMISSIONS
+        )
+        for n, token in enumerate(HELPER_BOT_TOKENS, 1)
+    ] + [
+        Client(
+            f"helper_session_{n}{tag}",
+            api_id=API_ID,
+            api_hash=API_HASH,
+            session_string=session,
+            in_memory=True,
+            no_updates=True,
+            max_concurrent_transmissions=MAX_TRANSMISSIONS
+        )
+        for n, session in enumerate(HELPER_SESSIONS, 1)
+    ]
+
+def make_client_pool(client, sessions, helpers):
+    return ClientPool(client, sessions, [
+        (helper, MediaSessionPool(helper, size=max(DOWNLOAD_CONNECTIONS, UPLOAD_CONNECTIONS)))
+        for helper in helpers
+    ])
 
-@web_app.route('/')
-def home():
-    return "Bot is running successfully! 🚀"
+client_pool = make_client_pool(app, media_sessions, make_helper_clients())
 
-@web_app.route('/status')
-def status():
+# --- Web Server (runs on the bot's event loop) ---
+def web_status():
     return {
         "status": "online",
         "port": PORT,
-        "bot_connected": True,
-        "active_tasks": len(user_tasks)
+        "bot_connected": app.is_connected,
+        "active_tasks": scheduler.running_count,
+        "queued_tasks": scheduler.queued_count,
+        "disk_free": disk_reservations.free(),
+        "disk_reserved": disk_reservations.reserved
     }
 
-def run_web_server():
+async def web_ready():
+    """Readiness: the client is connected and Telegram answers a ping"""
+    if not app.is_connected:
+        return False, "telegram client not connected"
     try:
-        web_app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
+        await asyncio.wait_for(app.invoke(raw.functions.Ping(ping_id=int(time.time()))), timeout=5)
     except Exception as e:
-        print(f"Web server error: {e}")
+        return False, f"telegram ping failed: {e}"
+    return True, "ok"
+
+def web_metrics():
+    yield from REGISTRY.collect()
+    yield "# TYPE bot_jobs_running gauge"
+    yield f"bot_jobs_running {scheduler.running_count}"
+    yield "# TYPE bot_jobs_queued gauge"
+    yield f"bot_jobs_queued {scheduler.queued_count}"
+    yield "# TYPE bot_status_frames_dropped_total counter"
+    yield f"bot_status_frames_dropped_total {progress_renderer.frames_dropped}"
+    yield "# TYPE bot_thumbnail_cache_hits_total counter"
+    yield f"bot_thumbnail_cache_hits_total {thumb_cache.hits}"
+    yield "# TYPE bot_thumbnail_cache_misses_total counter"
+    yield f"bot_thumbnail_cache_misses_total {thumb_cache.misses}"
+
+web_server = WebServer(PORT, web_status, web_ready, web_metrics)
 
-# --- In-memory storage for user states ---
-user_tasks = {}
-progress_data = {}
-thumbnail_requests = {}
+# --- Persistent storage for user states ---
+# Values are plain JSON; assign a key again after changing its value so it gets saved
+state_store = open_state_store(STATE_DB)
+user_tasks = state_store.mapping("user_tasks", int)        # file currently waiting for a name, per user
+pending_files = state_store.mapping("pending_files", int)  # list of further files waiting for a name, per user
+thumbnail_requests = state_store.mapping("thumbnail_requests", int)
+stored_jobs = state_store.mapping("jobs", int)             # queued and running jobs, re-queued on startup
+progress_data = {}       # keyed by job id, rebuilt whenever a job (re)starts
+sent_files = SentFileCache(state_store.mapping("sent_files"), max_entries=SENT_CACHE_SIZE)
+source_cache = SourceCache(process_dir(SOURCE_CACHE_DIR), max_bytes=SOURCE_CACHE_MB * 1024 * 1024, ttl=SOURCE_CACHE_TTL)
+
+# Fair-share weight per user, set by the admin with /priority; 1 when unset
+user_weights = state_store.mapping("user_weights", int)
+
+# Parts collected by /join per user, until /join done
+join_sessions = state_store.mapping("join_sessions", int)
+
+# Saved rename presets per user, as {name: rules text}; compile_preset() caches the compiled rules
+rename_presets = state_store.mapping("rename_presets", int)
+
+# Active /batch template per user, saved as template/pattern/counter
+batch_records = state_store.mapping("batch_sessions", int)
+batch_sessions = {
+    user_id: BatchTemplate(r["template"], r["pattern"], r["counter"])
+    for user_id, r in batch_records.items()
+}
+
+def save_batch_session(user_id):
+    session = batch_sessions.get(user_id)
+    if session:
+        batch_records[user_id] = {
+            "template": session.template,
+            "pattern": session.pattern.pattern if session.pattern else None,
+            "counter": session.counter
+        }
+    elif user_id in batch_records:
+        del batch_records[user_id]
+
+# All status message edits go through one paced, coalescing renderer
+progress_renderer = ProgressRenderer(chat_interval=EDIT_INTERVAL, global_rate=EDIT_RATE)
+
+# Jobs only start once the download disk has room for what they will write
+os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+disk_reservations = DiskReservations(DOWNLOAD_DIR, headroom=DISK_HEADROOM_MB * 1024 * 1024)
+disk_waits = set()   # ids of jobs already told they wait for disk space
+tag_failures = set()   # ids of jobs whose file was sent without the tags ffmpeg could not write
+
+def admit_job(job):
+    """Reserve disk space for a job, or keep it queued while other jobs hold the space"""
+    size = job.task.get("file_size") or 0
+    if in_memory(job.task):
+        size = 0
+    elif retag_format(job.task) or job.task.get("split_size") or job.task.get("join_parts") or (
+        STREAM_MODE and not rewrites_file(job.task)
+    ):
+        # Only what does not fit in the memory buffer is spilled to disk
+        size = max(0, size - STREAM_BUFFER_MB * 1024 * 1024)
+    elif rewrites_file(job.task):
+        # The retagged or rewritten copy is written next to the download
+        size *= 2
+    if disk_reservations.try_reserve(job.id, size, job_workspace(job).path):
+        disk_waits.discard(job.id)
+        return True
+    if job.id not in disk_waits and job.status_message:
+        disk_waits.add(job.id)
+        progress_renderer.submit(
+            job.status_message,
+            f"💾 **Job** `{job.id}` **is waiting for disk space** ({humanbytes(size)} needed, "
+            f"{humanbytes(max(0, disk_reservations.available()))} available)"
+        )
+    return False
+
+def job_finished(job):
+    stored_jobs.pop(job.id, None)
+    disk_reservations.release(job.id)
+    disk_waits.discard(job.id)
+
+# In worker mode the transfers run in child processes that report back to this one
+worker_pool = WorkerPool(
+    WORKER_PROCESSES,
+    env=dict(os.environ, STATE_DB="memory://", WORKER_PROCESSES="0"),
+    on_event=lambda event: sent_files.put(event["key"], event["file_id"]) if event["event"] == "sent" else None
+) if WORKER_PROCESSES else None
+
+# Rename jobs run on a pool of workers instead of inline in the message handlers
+scheduler = JobScheduler(
+    lambda job: process_remote(job) if worker_pool else process_file(app, job),
+    workers=WORKERS,
+    # Every client of the pool brings its own transfer slots
+    max_transmissions=MAX_TRANSMISSIONS * len(client_pool),
+    on_done=job_finished,
+    admit=admit_job,
+    weight=lambda user_id: user_weights.get(user_id, 1),
+    rate=SCHEDULE_SPEED_MB * 1024 * 1024,
+    # Updates are handled before restore_jobs() runs; new jobs must not reuse a stored job's id
+    first_id=max(stored_jobs, default=0) + 1
+)
+
+# Cleans up workspaces of jobs that no longer exist
+janitor = WorkspaceJanitor(
+    DOWNLOAD_DIR,
+    lambda: {record["task"]["work_id"] for record in stored_jobs.values()},
+    max_bytes=DOWNLOAD_DISK_CAP_MB * 1024 * 1024
+)
 
 # --- Thumbnail Storage ---
+# Older versions kept the permanent thumbnail in this file; it is imported once
 THUMBNAIL_FILE = "permanent_thumbnail.json"
 
 def load_thumbnail():
     if os.path.exists(THUMBNAIL_FILE):
         try:
             with open(THUMBNAIL_FILE, 'r') as f:
-                return json.load(f)
+                state_store.set("settings", "permanent_thumbnail", json.load(f))
+            os.remove(THUMBNAIL_FILE)
         except:
-            return None
-    return None
+            pass
+    return state_store.get("settings", "permanent_thumbnail")
 
-def save_thumbnail(thumbnail_id):
-    with open(THUMBNAIL_FILE, 'w') as f:
-        json.dump({"thumbnail_id": thumbnail_id}, f)
+def save_thumbnail(thumbnail_id, unique_id=None):
+    state_store.set("settings", "permanent_thumbnail", {"thumbnail_id": thumbnail_id, "unique_id": unique_id})
 
 def delete_thumbnail():
-    if os.path.exists(THUMBNAIL_FILE):
-        os.remove(THUMBNAIL_FILE)
+    state_store.delete("settings", "permanent_thumbnail")
 
 # Load permanent thumbnail
 permanent_thumbnail = load_thumbnail()
 
+# Downloaded thumbnails are kept on disk so they are not fetched again for every upload
+thumb_cache = ThumbnailCache(process_dir("thumbnails"), max_entries=THUMB_CACHE_SIZE)
+if permanent_thumbnail:
+    thumb_cache.pin(permanent_thumbnail['thumbnail_id'], permanent_thumbnail.get('unique_id'))
+
+media_inspector = MediaInspector(
+    max_concurrent=PROBE_CONCURRENCY,
+    thumb_dir=os.path.join(process_dir("thumbnails"), "generated")
+)
+
+def task_thumbnail(task):
+    """Return (file_id, unique_id) of the thumbnail to use for a task, or None"""
+    if task.get("thumbnail_id"):
+        return task["thumbnail_id"], task.get("thumbnail_unique_id")
+    if permanent_thumbnail:
+        return permanent_thumbnail['thumbnail_id'], permanent_thumbnail.get('unique_id')
+    return None
+
 # --- Helper Functions ---
 def humanbytes(size):
     """Convert bytes to human readable format"""
@@ -118,28 +383,13 @@ def create_progress_bar(percentage, bar_length=20):
     remaining = bar_length - completed
     return "█" * completed + "░" * remaining
 
-def sanitize_filename(filename):
-    """Remove invalid characters from filename"""
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        filename = filename.replace(char, '')
-    return filename.strip()
-
-def extract_extension(filename):
-    """Extract file extension from filename"""
-    if '.' in filename:
-        return '.' + filename.split('.')[-1].lower()
-    return ''
-
 def build_final_filename(original_name, user_input, prefix="", suffix=""):
     """Build the final filename with prefix and suffix"""
-    extension = extract_extension(original_name)
-    base_name = original_name.replace(extension, '') if extension else original_name
+    base_name, extension = split_extension(original_name)
     
     if user_input:
         if '.' in user_input:
-            user_extension = extract_extension(user_input)
-            user_base = user_input.replace(user_extension, '')
+            user_base, user_extension = split_extension(user_input)
             final_name = f"{prefix}{user_base}{suffix}{user_extension}"
         else:
             final_name = f"{prefix}{user_input}{suffix}{extension}"
@@ -149,21 +399,15 @@ def build_final_filename(original_name, user_input, prefix="", suffix=""):
     return sanitize_filename(final_name)
 
 async def safe_edit_message(message, text):
-    """Safely edit a message with flood wait handling."""
-    try:
-        await message.edit_text(text=text)
-    except FloodWait as e:
-        print(f"Flood wait: Waiting {e.value} seconds")
-        await asyncio.sleep(e.value)
-    except Exception:
-        pass
-
-async def update_progress_display(user_id, action):
-    """Update the progress display for a user"""
-    if user_id not in progress_data:
-        return
+    """Queue a message edit on the progress renderer, which handles pacing and flood waits."""
+    progress_renderer.submit(message, text)
+
+def render_progress(job_id, action):
+    """Render the progress display for a job from its latest progress data"""
+    if job_id not in progress_data:
+        return None
     
-    data = progress_data[user_id]
+    data = progress_data[job_id]
     current = data.get('current', 0)
     total = data.get('total', 1)
     start_time = data.get('start_time', time.time())
@@ -181,8 +425,8 @@ async def update_progress_display(user_id, action):
         instant_speed = 0
     
     # Update last values for next calculation
-    progress_data[user_id]['last_current'] = current
-    progress_data[user_id]['last_time'] = current_time
+    progress_data[job_id]['last_current'] = current
+    progress_data[job_id]['last_time'] = current_time
     
     if instant_speed > 0 and total > current:
         eta = (total - current) / instant_speed
@@ -203,37 +447,21 @@ async def update_progress_display(user_id, action):
         f"⏳ **ETA:** {format_time(eta)}\n"
     )
     
-    try:
-        await safe_edit_message(data['status_message'], progress_text)
-    except Exception:
-        pass
-
-def create_progress_callback(user_id, action):
-    """Create a progress callback function that updates progress_data"""
-    def callback(current, total):
-        if user_id not in progress_data:
+    return progress_text
+
+def create_progress_callback(job_id, action):
+    """Create a progress callback that records the latest state and lets the renderer draw it"""
+    async def callback(current, total):
+        if job_id not in progress_data:
             return
             
-        progress_data[user_id].update({
+        data = progress_data[job_id]
+        data.update({
             'current': current,
-            'total': total if total > 0 else progress_data[user_id].get('total', 1),
+            'total': total if total > 0 else data.get('total', 1),
             'last_update': time.time()
         })
-        
-        current_time = time.time()
-        if (current_time - progress_data[user_id].get('last_display_update', 0) >= 1 or 
-            current == total):
-            
-            progress_data[user_id]['last_display_update'] = current_time
-            
-            if hasattr(app, 'loop'):
-                try:
-                    future = asyncio.run_coroutine_threadsafe(
-                        update_progress_display(user_id, action), 
-                        app.loop
-                    )
-                except:
-                    pass
+        progress_renderer.submit(data['status_message'], lambda: render_progress(job_id, action))
     return callback
 
 def parse_filename_input(user_input, original_filename):
@@ -245,7 +473,7 @@ def parse_filename_input(user_input, original_filename):
     if not user_input:
         return prefix, suffix, original_filename
     
-    if 'prefix:' in user_input or 'suffix:' in user_input:
+    if any(key in user_input for key in ('prefix:', 'suffix:', 'title:', 'artist:', 'members')):
         parts = user_input.split('|')
         for part in parts:
             part = part.strip()
@@ -253,6 +481,8 @@ def parse_filename_input(user_input, original_filename):
                 prefix = part.replace('prefix:', '').strip()
             elif part.startswith('suffix:'):
                 suffix = part.replace('suffix:', '').strip()
+            elif part.startswith(('title:', 'artist:')) or part == 'members':
+                continue
             else:
                 filename = part
     else:
@@ -260,6 +490,99 @@ def parse_filename_input(user_input, original_filename):
     
     return prefix, suffix, filename
 
+def parse_tag_input(user_input):
+    """Parse title:/artist: parts of the user input into container tags"""
+    tags = {}
+    for part in (user_input or "").split('|'):
+        part = part.strip()
+        for key in ('title', 'artist'):
+            if part.startswith(key + ':') and part[len(key) + 1:].strip():
+                tags[key] = part[len(key) + 1:].strip()
+    return tags
+
+def media_tags(task):
+    """Container tags to write into a renamed video/audio, or None to upload it unchanged"""
+    if task["file_type"] not in ("video", "audio") or task.get("split_size"):
+        return None
+    tags = dict(task.get("tags") or {})
+    if RETAG_MEDIA:
+        tags.setdefault("title", os.path.splitext(task["new_name"])[0])
+    return tags or None
+
+def retag_format(task):
+    """ffmpeg muxer that retags a task's file on the streamed bytes, or None when it is retagged on disk"""
+    if not media_tags(task):
+        return None
+    return stream_format(task.get("original_filename"), task["new_name"])
+
+def tagged_meta(meta, tags):
+    """Upload attributes showing the title/artist tags written into the file"""
+    meta = dict(meta or {})
+    meta["title"] = tags.get("title") or meta.get("title")
+    meta["performer"] = tags.get("artist") or meta.get("performer")
+    return meta
+
+def member_rules(task):
+    """Prefix/suffix for the files inside a ZIP document, or None to upload the archive unchanged"""
+    if not task.get("rename_members") or task.get("split_size") or not (task.get("prefix") or task.get("suffix")):
+        return None
+    return {"prefix": task.get("prefix", ""), "suffix": task.get("suffix", "")}
+
+def member_filename(name, rules):
+    """New name of a file inside an archive; its folder is kept"""
+    folder, slash, base = name.rpartition("/")
+    return folder + slash + build_final_filename(base, "", rules["prefix"], rules["suffix"])
+
+def rewrites_file(task):
+    """Whether the file is rewritten, which rules out the in-memory rename and, unless retag_format() allows it, the streamed one"""
+    return bool(media_tags(task) or member_rules(task))
+
+PART_NAME = re.compile(r"^(?P<base>.+)\.part(?P<number>\d+)(?P<ext>\.[^.]+)?$", re.IGNORECASE)
+
+def part_filename(name, number):
+    """Name of part `number` (from 1) of a split file: `name.part001.ext`"""
+    return build_final_filename(name, "", suffix=f".part{number:03d}")
+
+def split_names(task):
+    """Names of the parts a task's file is split into"""
+    count = math.ceil(task["file_size"] / task["split_size"])
+    return [part_filename(task["new_name"], n) for n in range(1, count + 1)]
+
+def join_task(parts):
+    """A task that streams received parts (`name.part001.ext`, ...) back into one file"""
+    numbered = {}
+    for part in parts:
+        match = PART_NAME.match(part["original_filename"])
+        if not match:
+            raise ValueError(f"`{part['original_filename']}` is not named like `name.part001.ext`")
+        if int(match["number"]) in numbered:
+            raise ValueError(f"Part {int(match['number'])} was sent twice")
+        numbered[int(match["number"])] = part
+    missing = [str(n) for n in range(1, max(numbered) + 1) if n not in numbered]
+    if missing:
+        raise ValueError(f"Missing part(s): {', '.join(missing)}")
+
+    ordered = [numbered[n] for n in sorted(numbered)]
+    names = set()
+    for part in ordered:
+        match = PART_NAME.match(part["original_filename"])
+        names.add(match["base"] + (match["ext"] or "").lower())
+    if len(names) > 1:
+        raise ValueError("The parts belong to different files")
+    size = sum(part["file_size"] for part in ordered)
+    if size > UPLOAD_LIMIT_MB * 1024 * 1024:
+        raise ValueError(f"The joined file ({humanbytes(size)}) would be larger than the upload limit")
+
+    name = sanitize_filename(names.pop())
+    return {
+        "file_type": "document",
+        "message_id": ordered[0]["message_id"],
+        "file_size": size,
+        "original_filename": name,
+        "new_name": name,
+        "join_parts": [{"file_id": p["file_id"], "file_size": p["file_size"]} for p in ordered]
+    }
+
 # --- Command Handlers ---
 @app.on_message(filters.command("start") & filters.private)
 async def start_handler(client: Client, message: Message):
@@ -286,7 +609,24 @@ async def help_handler(client: Client, message: Message):
         "**Examples:**\n"
         "• `prefix:NEW_|myfile` → `NEW_myfile.ext`\n"
         "• `suffix:_2024|document` → `document_2024.ext`\n"
-        "• `myfile` → `myfile.ext` (normal rename)\n\n"
+        "• `myfile` → `myfile.ext` (normal rename)\n"
+        "• `title:My Song|artist:Me|myfile` → also sets the title/artist tags of a video or audio\n"
+        "• `prefix:NEW_|members` → also renames the files inside a .zip document\n\n"
+        "**Batch templates:**\n"
+        "Reply with a template to rename every waiting file at once, or use "
+        "`/batch <template>` for all files you send next (`/batch off` to stop).\n"
+        "Placeholders: `{n:03}` number, `{orig}` old name, `{ext}` extension, `{size}` size, "
+        "`{1}`… regex groups via `/batch <regex> => <template>`\n"
+        "• `Show S01E{n:02}` → `Show S01E01.mkv`, `Show S01E02.mkv`, …\n\n"
+        "**Presets:**\n"
+        "Save reusable rules with /preset, try them on a list of names with "
+        "`/preview <preset>` and reply `preset:<name>` to rename every waiting file.\n\n"
+        "**Queue:**\n"
+        "• /queue - Show your queued and running jobs\n"
+        "• /cancel - Cancel the file waiting for a name\n"
+        "• /cancel <job> - Cancel a queued or running job\n"
+        "• /join - Send `name.part001.ext`… parts to get them back as one file\n"
+        "Smaller files start first; large ones move up the longer they wait.\n\n"
         "Send me a file to get started!"
     )
     await message.reply_text(help_text, quote=True)
@@ -300,12 +640,25 @@ async def status_handler(client: Client, message: Message):
         return
         
     thumbnail_status = "✅ Set" if permanent_thumbnail else "❌ Not set"
+    clients_status = ", ".join(
+        f"{m.name} {m.active} active" + (f" (cooling down {int(m.cooldown)}s)" if m.cooldown else "")
+        for m in client_pool.members
+    )
     
     status_text = (
         "🤖 **Bot Status**\n"
         f"• **Running on:** Port {PORT}\n"
-        f"• **Active tasks:** {len(user_tasks)}\n"
+        f"• **Active tasks:** {scheduler.running_count}\n"
+        f"• **Queued tasks:** {scheduler.queued_count}\n"
+        f"• **Workers:** {WORKERS} (max {MAX_TRANSMISSIONS * len(client_pool)} transfers)\n"
+        f"• **Clients:** {clients_status}\n"
         f"• **Permanent Thumbnail:** {thumbnail_status}\n"
+        f"• **Thumbnail cache:** {thumb_cache.hits} hits / {thumb_cache.misses} misses ({len(thumb_cache)} cached)\n"
+        f"• **Downloads:** {humanbytes(janitor.usage)} on disk, {janitor.removed} orphan(s) cleaned up\n"
+        f"• **Sent-file cache:** {len(sent_files.mapping)} files, {sent_files.hits} resends\n"
+        f"• **Source cache:** {humanbytes(source_cache.size)} in {len(source_cache)} files, {source_cache.hits} hits\n"
+        f"• **Disk:** {humanbytes(disk_reservations.free())} free, "
+        f"{humanbytes(disk_reservations.reserved)} reserved by {len(disk_reservations)} job(s)\n"
         f"• **Bot connected:** ✅\n"
         f"• **Web server:** ✅\n"
     )
@@ -330,6 +683,7 @@ async def thumbnail_command_handler(client: Client, message: Message):
             delete_thumbnail()
             global permanent_thumbnail
             permanent_thumbnail = None
+            thumb_cache.pin(None)
             await message.reply_text(
                 "✅ Permanent thumbnail has been removed.",
                 quote=True
@@ -367,19 +721,376 @@ async def thumbnail_command_handler(client: Client, message: Message):
             quote=True
         )
 
+@app.on_message(filters.command("batch") & filters.private)
+async def batch_handler(client: Client, message: Message):
+    """Handles the /batch command to rename every following file with one template."""
+    user_id = message.from_user.id
+    if user_id != ADMIN_ID:
+        await message.reply_text("Sorry, this command is for admin only.", quote=True)
+        return
+
+    args = message.text.split(None, 1)[1].strip() if len(message.command) > 1 else ""
+    if not args:
+        session = batch_sessions.get(user_id)
+        if session:
+            await message.reply_text(
+                f"📦 **Batch mode is on**\n• **Template:** `{session.template}`\n"
+                f"• **Next number:** {session.counter}\n\nUse /batch off to stop.",
+                quote=True
+            )
+        else:
+            await message.reply_text(
+                "Usage: `/batch <template>` or `/batch <regex> => <template>`\n"
+                "Example: `/batch Show S01E{n:02}`",
+                quote=True
+            )
+        return
+
+    if args.lower() == "off":
+        session = batch_sessions.pop(user_id, None)
+        save_batch_session(user_id)
+        if session:
+            await message.reply_text(f"✅ Batch mode stopped after {session.counter - 1} file(s).", quote=True)
+        else:
+            await message.reply_text("Batch mode is not active.", quote=True)
+        return
+
+    try:
+        batch_sessions[user_id] = parse_batch_command(args)
+    except ValueError as e:
+        await message.reply_text(f"❌ {e}", quote=True)
+        return
+    save_batch_session(user_id)
+
+    await message.reply_text(
+        f"📦 **Batch mode on.** Every file you send now is renamed with `{batch_sessions[user_id].template}` "
+        "and queued right away.\nUse /batch off to stop.",
+        quote=True
+    )
+
+def user_preset(user_id, name):
+    """The compiled preset `name` of a user; ValueError if there is none."""
+    text = rename_presets.get(user_id, {}).get(name)
+    if text is None:
+        raise ValueError(f"No preset `{name}`, see /preset")
+    return compile_preset(text)
+
+@app.on_message(filters.command("preset") & filters.private)
+async def preset_handler(client: Client, message: Message):
+    """Handles the /preset command to save, show and delete rename presets."""
+    user_id = message.from_user.id
+    if user_id != ADMIN_ID:
+        await message.reply_text("Sorry, this command is for admin only.", quote=True)
+        return
+
+    presets = dict(rename_presets.get(user_id, {}))
+    args = message.text.split(None, 2)[1:] if message.text else []
+    action = args[0].lower() if args else ""
+
+    if action == "save" and len(args) == 2 and "\n" in args[1]:
+        name, rules = args[1].split("\n", 1)
+        name = name.strip()
+        try:
+            compile_preset(rules.strip())
+        except ValueError as e:
+            await message.reply_text(f"❌ {e}", quote=True)
+            return
+        presets[name] = rules.strip()
+        rename_presets[user_id] = presets
+        await message.reply_text(
+            f"✅ Preset `{name}` saved. Reply `preset:{name}` to a file, or /preview {name} to try it.",
+            quote=True
+        )
+    elif action in ("show", "delete") and len(args) == 2:
+        name = args[1].strip()
+        if name not in presets:
+            await message.reply_text(f"❌ No preset `{name}`.", quote=True)
+        elif action == "show":
+            await message.reply_text(f"**Preset `{name}`**\n```\n{presets[name]}\n```", quote=True)
+        else:
+            del presets[name]
+            rename_presets[user_id] = presets
+            await message.reply_text(f"🗑️ Preset `{name}` deleted.", quote=True)
+    elif not action and presets:
+        await message.reply_text(
+            "**Your presets:**\n" + "\n".join(f"• `{name}`" for name in sorted(presets)),
+            quote=True
+        )
+    else:
+        await message.reply_text(
+            "**Rename presets**\n\n"
+            "`/preset save <name>` followed by one rule per line:\n"
+            "`replace: <regex> => <replacement>`\n"
+            "`case: lower|upper|title`\n"
+            "`prefix: <text>` / `suffix: <text>`\n"
+            "`ext: mkv => mp4` (`*` for any extension)\n\n"
+            "/preset show <name>, /preset delete <name>\n"
+            "Reply `preset:<name>` to rename every waiting file with it.",
+            quote=True
+        )
+
+@app.on_message(filters.command("preview") & filters.private)
+async def preview_handler(client: Client, message: Message):
+    """Handles the /preview command to dry-run a preset over a list of names."""
+    user_id = message.from_user.id
+    if user_id != ADMIN_ID:
+        await message.reply_text("Sorry, this command is for admin only.", quote=True)
+        return
+
+    first_line, _, rest = (message.text or "").partition("\n")
+    args = first_line.split(None, 1)
+    if len(args) < 2:
+        await message.reply_text(
+            "Usage: `/preview <preset>` followed by one filename per line, "
+            "or without names to preview the files waiting for a name.",
+            quote=True
+        )
+        return
+    try:
+        preset = user_preset(user_id, args[1].strip())
+    except ValueError as e:
+        await message.reply_text(f"❌ {e}", quote=True)
+        return
+
+    names = [line.strip() for line in rest.splitlines() if line.strip()]
+    if not names and user_id in user_tasks:
+        names = [t["original_filename"] for t in [user_tasks[user_id]] + list(pending_files.get(user_id, ()))]
+    if not names:
+        await message.reply_text("No filenames given and no files waiting for a name.", quote=True)
+        return
+
+    results = preset.preview(names)
+    failed = sum(1 for _, _, error in results if error)
+    lines = [f"🔍 **Preview of `{args[1].strip()}`:** {len(results)} name(s), {failed} failed\n"]
+    length = len(lines[0])
+    for shown, (original, new_name, error) in enumerate(results):
+        line = f"• `{original}` → " + (f"`{new_name}`" if new_name else f"❌ {error}")
+        # Stay below Telegram's message length limit
+        if length + len(line) > 3900:
+            lines.append(f"… and {len(results) - shown} more")
+            break
+        lines.append(line)
+        length += len(line) + 1
+    await message.reply_text("\n".join(lines), quote=True)
+
+@app.on_message(filters.command("join") & filters.private)
+async def join_handler(client: Client, message: Message):
+    """Handles the /join command to stream the parts of a split file back into one file."""
+    user_id = message.from_user.id
+    if user_id != ADMIN_ID:
+        await message.reply_text("Sorry, this command is for admin only.", quote=True)
+        return
+
+    action = message.command[1].lower() if len(message.command) > 1 else ""
+    if action in ("off", "cancel"):
+        join_sessions.pop(user_id, None)
+        await message.reply_text("✅ Join mode stopped, the received parts were dropped.", quote=True)
+    elif action == "done":
+        parts = join_sessions.get(user_id)
+        if not parts:
+            await message.reply_text("No parts received yet. Start with /join and send the parts.", quote=True)
+            return
+        try:
+            task = join_task(parts)
+        except ValueError as e:
+            await message.reply_text(f"❌ {e}", quote=True)
+            return
+        del join_sessions[user_id]
+        await enqueue_task(message, user_id, task)
+    elif user_id in join_sessions:
+        await message.reply_text(
+            f"🧩 {len(join_sessions[user_id])} part(s) received. "
+            "Send the rest, then /join done (or /join off to stop).",
+            quote=True
+        )
+    else:
+        join_sessions[user_id] = []
+        await message.reply_text(
+            "🧩 **Join mode on.** Send the parts (`name.part001.ext`, `name.part002.ext`, …) "
+            "in any order, then /join done to get them back as one file.",
+            quote=True
+        )
+
+@app.on_message(filters.command("queue") & filters.private)
+async def queue_handler(client: Client, message: Message):
+    """Handles the /queue command to list a user's jobs."""
+    user_id = message.from_user.id
+    jobs = scheduler.user_jobs(user_id)
+    if not jobs:
+        await message.reply_text("You have no queued or running jobs.", quote=True)
+        return
+
+    lines = ["📋 **Your jobs**\n"]
+    for job in jobs:
+        state = "▶️ running" if job.status == "running" else f"⏳ queued (#{scheduler.position(job)})"
+        lines.append(f"• `{job.id}` {state} - `{job.name}`")
+    lines.append("\nUse /cancel <job> to cancel a job.")
+    await message.reply_text("\n".join(lines), quote=True)
+
+@app.on_message(filters.command("priority") & filters.private)
+async def priority_handler(client: Client, message: Message):
+    """Handles the /priority command to prioritise a job or weight a user's share."""
+    user_id = message.from_user.id
+    if user_id != ADMIN_ID:
+        await message.reply_text("Sorry, this command is for admin only.", quote=True)
+        return
+
+    args = message.command[1:]
+    try:
+        if len(args) == 3 and args[0].lower() == "user":
+            target, weight = int(args[1]), float(args[2])
+            if weight <= 0:
+                raise ValueError
+        elif len(args) == 2:
+            job_id, priority = int(args[0]), int(args[1])
+        else:
+            raise ValueError
+    except ValueError:
+        await message.reply_text(
+            "Usage:\n"
+            "`/priority <job> <level>` - jobs with a higher level start first (default 0)\n"
+            "`/priority user <user id> <weight>` - share of the workers a user gets (default 1)",
+            quote=True
+        )
+        return
+
+    if len(args) == 3:
+        if weight == 1:
+            user_weights.pop(target, None)
+        else:
+            user_weights[target] = weight
+        await message.reply_text(f"⚖️ User `{target}` now has weight {weight:g}.", quote=True)
+        return
+
+    job = scheduler.jobs.get(job_id)
+    if not job or job.status != "queued":
+        await message.reply_text(f"❌ No queued job `{job_id}` found.", quote=True)
+        return
+    job.task["priority"] = priority
+    save_job_task(job)
+    await message.reply_text(f"✅ Job `{job_id}` now has priority {priority}.", quote=True)
+
 @app.on_message(filters.command("cancel") & filters.private)
 async def cancel_handler(client: Client, message: Message):
-    """Handles the /cancel command to clear a user's current task."""
+    """Handles the /cancel command to clear a user's current task or a queued job."""
     user_id = message.from_user.id
+
+    if len(message.command) > 1:
+        try:
+            job_id = int(message.command[1])
+        except ValueError:
+            await message.reply_text("Usage: /cancel <job>", quote=True)
+            return
+        job = scheduler.jobs.get(job_id)
+        if not job or (job.user_id != user_id and user_id != ADMIN_ID):
+            await message.reply_text(f"❌ No job `{job_id}` found.", quote=True)
+            return
+        scheduler.cancel(job_id)
+        await message.reply_text(f"🛑 Job `{job_id}` has been cancelled.", quote=True)
+        return
+
     if user_id in user_tasks:
         del user_tasks[user_id]
-    if user_id in progress_data:
-        del progress_data[user_id]
+    if user_id in pending_files:
+        del pending_files[user_id]
     if user_id in thumbnail_requests:
         del thumbnail_requests[user_id]
     await message.reply_text("Your current task has been cancelled.", quote=True)
 
 # --- Main Logic Handlers ---
+async def prompt_for_name(client: Client, user_id, task):
+    """Ask the user for the new name of a received file."""
+    split_note = ""
+    if task.get("split_size"):
+        split_note = (
+            f"✂️ Larger than the upload limit, it will be sent in "
+            f"{math.ceil(task['file_size'] / task['split_size'])} parts.\n"
+        )
+    await client.send_message(
+        user_id,
+        f"📁 **File Received:** `{task['original_filename']}`\n"
+        f"📊 **Size:** {humanbytes(task['file_size'])}\n{split_note}\n"
+        "Now, please send me the new filename or prefix/suffix format:",
+        reply_to_message_id=task["message_id"],
+        reply_markup=ForceReply(selective=True)
+    )
+
+async def enqueue_task(message: Message, user_id, task):
+    """Submit a configured task to the job queue and reply with its job id."""
+    task["work_id"] = f"{user_id}_{task.get('file_unique_id', task['message_id'])}_{int(time.time() * 1000)}"
+    status_message = await message.reply_text("Queued...", quote=True)
+    job = scheduler.submit(user_id, task, status_message)
+    stored_jobs[job.id] = {
+        "user_id": user_id,
+        "task": task,
+        "status_message_id": status_message.id
+    }
+    await safe_edit_message(
+        status_message,
+        f"⏳ **Queued as job** `{job.id}` (position {scheduler.position(job)})\n"
+        f"`{task['new_name']}`\n"
+        "Use /queue to see your jobs or /cancel <job> to cancel."
+    )
+    return job
+
+def apply_template(task, template: BatchTemplate):
+    """A copy of a task named from a batch template; the task itself is left unchanged."""
+    rendered = template.render(task["original_filename"], humanbytes(task["file_size"]))
+    return dict(task, new_name=build_final_filename(task["original_filename"], rendered), base_filename=rendered)
+
+async def submit_task(client: Client, message: Message, user_id):
+    """Move the user's configured task into the job queue and prompt for the next file."""
+    task = user_tasks.pop(user_id)
+    thumbnail_requests.pop(user_id, None)
+    await enqueue_task(message, user_id, task)
+
+    if pending_files.get(user_id):
+        next_task, *waiting = pending_files[user_id]
+        if waiting:
+            pending_files[user_id] = waiting
+        else:
+            del pending_files[user_id]
+        user_tasks[user_id] = next_task
+        await prompt_for_name(client, user_id, next_task)
+
+async def submit_template(client: Client, message: Message, user_id, user_input):
+    """Rename the waiting file and every file behind it with one template."""
+    try:
+        template = parse_batch_command(user_input)
+        # Name copies, so a file that cannot be named leaves every waiting file unchanged
+        tasks = [apply_template(task, template) for task in [user_tasks[user_id]] + list(pending_files.get(user_id, ()))]
+    except ValueError as e:
+        await message.reply_text(f"❌ {e}", quote=True)
+        return
+
+    del user_tasks[user_id]
+    pending_files.pop(user_id, None)
+    thumbnail_requests.pop(user_id, None)
+    save_batch_session(user_id)
+    for task in tasks:
+        await enqueue_task(message, user_id, task)
+
+async def submit_preset(client: Client, message: Message, user_id, name):
+    """Rename the waiting file and every file behind it with a saved preset."""
+    try:
+        preset = user_preset(user_id, name)
+        tasks = [user_tasks[user_id]] + list(pending_files.get(user_id, ()))
+        # Name every file before changing any, so one failure leaves them all waiting
+        names = [preset.apply(task["original_filename"]) for task in tasks]
+    except ValueError as e:
+        await message.reply_text(f"❌ {e}", quote=True)
+        return
+
+    tasks = [
+        dict(task, new_name=new_name, base_filename=split_extension(new_name)[0])
+        for task, new_name in zip(tasks, names)
+    ]
+    del user_tasks[user_id]
+    pending_files.pop(user_id, None)
+    thumbnail_requests.pop(user_id, None)
+    for task in tasks:
+        await enqueue_task(message, user_id, task)
+
 @app.on_message(filters.private & (filters.document | filters.video | filters.audio))
 async def file_handler(client: Client, message: Message):
     """Handles incoming files and starts the renaming process."""
@@ -418,21 +1129,60 @@ async def file_handler(client: Client, message: Message):
             ext = ".pdf"
         original_filename = f"file_{int(time.time())}{ext}"
 
-    user_tasks[user_id] = {
+    task = {
         "file_id": file.file_id,
+        "file_unique_id": file.file_unique_id,
         "file_type": file_type,
         "message_id": message.id,
         "file_size": file.file_size,
-        "original_filename": original_filename
+        "original_filename": original_filename,
+        "media_meta": get_media_meta(file_type, file)
     }
-    
-    await message.reply_text(
-        f"📁 **File Received:** `{original_filename}`\n"
-        f"📊 **Size:** {humanbytes(file.file_size)}\n\n"
-        "Now, please send me the new filename or prefix/suffix format:",
-        reply_to_message_id=message.id,
-        reply_markup=ForceReply(selective=True)
-    )
+
+    # Join mode: collect the parts until /join done
+    if user_id in join_sessions:
+        join_sessions[user_id] = join_sessions[user_id] + [task]
+        await message.reply_text(
+            f"🧩 Part `{original_filename}` received ({len(join_sessions[user_id])} so far). "
+            "Send /join done when all parts are in.",
+            quote=True
+        )
+        return
+
+    # Files too large to upload in one piece are split, or refused before anything is downloaded
+    if (file.file_size or 0) > UPLOAD_LIMIT_MB * 1024 * 1024:
+        if not SPLIT_LARGE_FILES:
+            await message.reply_text(
+                f"❌ `{original_filename}` ({humanbytes(file.file_size)}) is larger than the "
+                f"upload limit of {humanbytes(UPLOAD_LIMIT_MB * 1024 * 1024)}.",
+                quote=True
+            )
+            return
+        task["split_size"] = SPLIT_PART_MB * 1024 * 1024
+
+    # Batch mode: name the file from the template and queue it without asking
+    if user_id in batch_sessions:
+        try:
+            task = apply_template(task, batch_sessions[user_id])
+        except ValueError as e:
+            await message.reply_text(f"❌ {e}", quote=True)
+            return
+        save_batch_session(user_id)
+        await enqueue_task(message, user_id, task)
+        return
+
+    # Still waiting for the name of an earlier file: keep this one for later
+    if user_id in user_tasks:
+        pending_files[user_id] = pending_files.get(user_id, []) + [task]
+        await message.reply_text(
+            f"📥 `{original_filename}` received. "
+            f"I'll ask for its name after the current file ({len(pending_files[user_id])} waiting).",
+            quote=True
+        )
+        return
+
+    user_tasks[user_id] = task
+    await prompt_for_name(client, user_id, task)
 
 @app.on_message(filters.private & filters.text)
 async def name_and_thumbnail_handler(client: Client, message: Message):
@@ -446,7 +1196,7 @@ async def name_and_thumbnail_handler(client: Client, message: Message):
 
     if message.text == "/skip" and task["file_type"] == "video":
         task["thumbnail_id"] = None
-        await process_file(client, message)
+        await submit_task(client, message, user_id)
         return
 
     if message.text == "/help":
@@ -463,9 +1213,17 @@ async def name_and_thumbnail_handler(client: Client, message: Message):
             )
             return
         
+        if is_template(user_input):
+            await submit_template(client, message, user_id, user_input)
+            return
+
+        if user_input.startswith("preset:"):
+            await submit_preset(client, message, user_id, user_input[len("preset:"):].strip())
+            return
+
         prefix, suffix, filename = parse_filename_input(user_input, task["original_filename"])
         
-        if filename and any(c in filename for c in '<>:"/\\|?*'):
+        if filename and any(c in filename for c in INVALID_CHARS):
             await message.reply_text(
                 "❌ Invalid filename. Please provide a valid filename without special characters.",
                 quote=True
@@ -483,6 +1241,13 @@ async def name_and_thumbnail_handler(client: Client, message: Message):
         task["prefix"] = prefix
         task["suffix"] = suffix
         task["base_filename"] = filename
+        task["tags"] = parse_tag_input(user_input)
+        task["rename_members"] = (
+            task["file_type"] == "document"
+            and task["original_filename"].lower().endswith(".zip")
+            and any(part.strip() == "members" for part in user_input.split("|"))
+        )
+        user_tasks[user_id] = task
         
         confirmation_text = f"✅ **Filename configured:**\n\n"
         if prefix:
@@ -491,6 +1256,10 @@ async def name_and_thumbnail_handler(client: Client, message: Message):
             confirmation_text += f"• **Suffix:** `{suffix}`\n"
         if filename:
             confirmation_text += f"• **Filename:** `{filename}`\n"
+        for key, value in task["tags"].items():
+            confirmation_text += f"• **{key.title()} tag:** `{value}`\n"
+        if member_rules(task):
+            confirmation_text += "• **Archive:** the files inside get the same prefix/suffix\n"
         confirmation_text += f"• **Final name:** `{final_filename}`\n\n"
         
         if task["file_type"] == "video":
@@ -502,9 +1271,8 @@ async def name_and_thumbnail_handler(client: Client, message: Message):
                 reply_markup=ForceReply(selective=True)
             )
         else:
-            confirmation_text += "Starting processing..."
             await message.reply_text(confirmation_text, quote=True)
-            await process_file(client, message)
+            await submit_task(client, message, user_id)
 
 @app.on_message(filters.private & filters.photo)
 async def thumbnail_handler(client: Client, message: Message):
@@ -514,9 +1282,13 @@ async def thumbnail_handler(client: Client, message: Message):
     if (user_id == ADMIN_ID and 
         not message.reply_to_message and 
         user_id not in thumbnail_requests):
-        save_thumbnail(message.photo.file_id)
+        save_thumbnail(message.photo.file_id, message.photo.file_unique_id)
         global permanent_thumbnail
-        permanent_thumbnail = {"thumbnail_id": message.photo.file_id}
+        permanent_thumbnail = {
+            "thumbnail_id": message.photo.file_id,
+            "unique_id": message.photo.file_unique_id
+        }
+        await thumb_cache.set_permanent(client, message.photo.file_id, message.photo.file_unique_id)
         await message.reply_text(
             "✅ Permanent thumbnail has been set! It will be used for all future uploads.",
             quote=True
@@ -528,9 +1300,12 @@ async def thumbnail_handler(client: Client, message: Message):
         "new_name" in user_tasks[user_id] and 
         user_tasks[user_id]["file_type"] == "video"):
         
-        user_tasks[user_id]["thumbnail_id"] = message.photo.file_id
+        task = user_tasks[user_id]
+        task["thumbnail_id"] = message.photo.file_id
+        task["thumbnail_unique_id"] = message.photo.file_unique_id
+        user_tasks[user_id] = task
         del thumbnail_requests[user_id]
-        await process_file(client, message)
+        await submit_task(client, message, user_id)
         return
     
     await message.reply_text(
@@ -539,164 +1314,555 @@ async def thumbnail_handler(client: Client, message: Message):
         quote=True
     )
 
-async def process_file(client: Client, message: Message):
-    """The main function to download, rename, and upload the file."""
-    user_id = message.from_user.id
-    task = user_tasks.get(user_id)
+def build_caption(task):
+    """Build the upload caption for a renamed file"""
+    caption_parts = []
+    if task.get("prefix"):
+        caption_parts.append(f"**Prefix:** `{task['prefix']}`")
+    if task.get("suffix"):
+        caption_parts.append(f"**Suffix:** `{task['suffix']}`")
+    if task.get("base_filename"):
+        caption_parts.append(f"**Filename:** `{task['base_filename']}`")
+    
+    caption = f"📁 **Renamed to:** `{task['new_name']}`"
+    if caption_parts:
+        caption += "\n" + " | ".join(caption_parts)
+    return caption
 
-    if not task or "new_name" not in task:
-        return
+async def stream_process(member, job, thumbnail_path, file_id, chat_id):
+    """Rename a file by uploading it while it is still downloading.
+
+    Tags are written by piping the stream through ffmpeg; when that fails the file
+    is streamed again as it is.
+    """
+    task = job.task
+    tags = media_tags(task)
+    format_name = retag_format(task)
+    meta = tagged_meta(task.get("media_meta"), tags) if tags else task.get("media_meta")
+
+    async def stream(pipe=None):
+        async with scheduler.transmission():
+            with timed("stream", task.get("file_size")):
+                return await stream_rename(
+                    member.client,
+                    dict(task, file_id=file_id),
+                    chat_id,
+                    build_caption(task),
+                    thumb_path=thumbnail_path,
+                    meta=meta,
+                    buffer_size=STREAM_BUFFER_MB * 1024 * 1024,
+                    spill_dir=job_workspace(job).create().path,
+                    progress=create_progress_callback(job.id, "Streaming"),
+                    pipe=pipe
+                )
+
+    await safe_edit_message(job.status_message, "Streaming...")
+    if format_name:
+        try:
+            with timed("retag"):
+                return await stream(lambda read: media_inspector.retag_stream(read, tags, format_name))
+        except RetagError as e:
+            await tags_not_written(job, e)
+            reset_progress(job.id, task.get("file_size", 1))
+    return await stream()
+
+async def tags_not_written(job, error):
+    """Note that a job's file goes out without its new tags, which the final status then mentions"""
+    print(f"Tags of job {job.id} were not written: {error}")
+    tag_failures.add(job.id)
+    if job.task.get("tags"):
+        await safe_edit_message(job.status_message, "⚠️ The title/artist tags could not be written, sending the file without them...")
+
+def in_memory(task):
+    """Whether a task is small enough for the in-memory rename, which leaves tags alone"""
+    return (
+        0 < (task.get("file_size") or 0) <= MEMORY_RENAME_MB * 1024 * 1024
+        and not rewrites_file(task) and not task.get("join_parts")
+    )
+
+def save_job_task(job):
+    """Persist changes made to the task of a stored job"""
+    if job.id in stored_jobs:
+        stored_jobs[job.id] = dict(stored_jobs[job.id], task=job.task)
+
+def record_parts_sent(job, count):
+    """Remember how many parts of a split job were sent, so a retry or restart continues after them.
+    Worker processes replace this to report the count to the front-end."""
+    job.task["parts_sent"] = count
+    save_job_task(job)
+
+async def split_process(member, job, thumbnail_path, file_id, chat_id):
+    """Stream a file above the upload limit as numbered parts, each sent as soon as it is complete."""
+    task = job.task
+    names = split_names(task)
+
+    async def part_sent(index, message):
+        if chat_id != job.user_id:
+            # Uploaded by a helper: relay the part right away
+            await app.copy_message(job.user_id, chat_id, message.id)
+            await discard_relayed(app, [message.id])
+        record_parts_sent(job, index + 1)
 
-    status_message = await message.reply_text("Starting processing...", quote=True)
+    await safe_edit_message(job.status_message, f"Streaming in {len(names)} parts...")
+    async with scheduler.transmission():
+        with timed("split", task["file_size"]):
+            await split_rename(
+                member.client,
+                dict(task, file_id=file_id),
+                chat_id,
+                build_caption(task),
+                names,
+                task["split_size"],
+                thumb_path=thumbnail_path,
+                first_part=task.get("parts_sent", 0),
+                on_part=part_sent,
+                buffer_size=STREAM_BUFFER_MB * 1024 * 1024,
+                spill_dir=job_workspace(job).create().path,
+                progress=create_progress_callback(job.id, f"Streaming {len(names)} parts")
+            )
+
+async def join_process(member, job, thumbnail_path):
+    """Stream the parts of a /join job into one file, uploading while the parts download."""
+    task = job.task
+    await safe_edit_message(job.status_message, f"Joining {len(task['join_parts'])} parts...")
+    async with scheduler.transmission():
+        with timed("join", task["file_size"]):
+            return await join_rename(
+                member.client,
+                task["join_parts"],
+                job.user_id,
+                build_caption(task),
+                task["new_name"],
+                thumb_path=thumbnail_path,
+                buffer_size=STREAM_BUFFER_MB * 1024 * 1024,
+                spill_dir=job_workspace(job).create().path,
+                progress=create_progress_callback(job.id, "Joining")
+            )
+
+async def memory_process(member, job, thumbnail_path, file_id, chat_id):
+    """Rename a small file in memory: no workspace, no checkpoint, no temporary files."""
+    task = job.task
+    await safe_edit_message(job.status_message, "Downloading...")
+    async with scheduler.transmission():
+        with timed("memory", task["file_size"]):
+            return await memory_rename(
+                member.client,
+                dict(task, file_id=file_id),
+                chat_id,
+                build_caption(task),
+                thumb_path=thumbnail_path,
+                meta=task.get("media_meta"),
+                progress=create_progress_callback(job.id, "Uploading")
+            )
+
+def reset_progress(job_id, total):
+    """Restart the progress numbers of a job for a new transfer phase"""
+    progress_data[job_id].update({
+        'start_time': time.time(),
+        'current': 0,
+        'total': total,
+        'last_update': time.time(),
+        'last_current': 0,
+        'last_time': time.time()
+    })
+
+def job_workspace(job):
+    """The job's private download directory; stable across retries and restarts"""
+    return Workspace(DOWNLOAD_DIR, job.task["work_id"])
+
+async def transfer_file(member, job, thumbnail_path, file_id, chat_id):
+    """Download, rename and upload a job's file, resuming whatever an earlier attempt finished.
+
+    `member` is the pool client doing the transfer, `file_id` the source as that client
+    sees it and `chat_id` where the renamed file is sent.
+    """
+    client = member.client
+    task = job.task
+    status_message = job.status_message
+    workspace = job_workspace(job).create()
+    download_path = workspace.download_path
+    checkpoint = workspace.checkpoint
+
+    file_size = task.get("file_size", 0)
+    if not checkpoint.download_complete and source_cache.link_to(task.get("file_unique_id"), file_size, download_path):
+        checkpoint.downloaded = file_size
+        checkpoint.download_complete = True
+        checkpoint.save(force=True)
+
+    if not checkpoint.download_complete:
+        await safe_edit_message(status_message, "Downloading...")
+        reset_progress(job.id, task.get('file_size', 1))
+        download_callback = create_progress_callback(job.id, "Downloading")
+        async with scheduler.transmission():
+            with timed("download", file_size):
+                parallel = DOWNLOAD_CONNECTIONS > 1 and file_size > 2 * STREAM_CHUNK_SIZE
+                if parallel:
+                    try:
+                        await parallel_download(
+                            member.sessions, file_id, download_path, file_size, checkpoint,
+                            progress=download_callback,
+                            connections=DOWNLOAD_CONNECTIONS
+                        )
+                    except CdnRedirected:
+                        parallel = False
+                if not parallel:
+                    await resumable_download(
+                        client, file_id, download_path, file_size, checkpoint,
+                        progress=download_callback
+                    )
+        source_cache.add(task.get("file_unique_id"), download_path)
+        await safe_edit_message(status_message, "✅ Download complete. Preparing to upload...")
+
+    tags = media_tags(task)
+    if tags and os.path.exists(download_path):
+        # ffmpeg writes the retagged file next to the download, which only then is removed;
+        # on failure it is renamed as is
+        with timed("retag"):
+            if await media_inspector.retag(download_path, workspace.output_path(task["new_name"]), tags):
+                os.remove(download_path)
+            else:
+                await tags_not_written(job, "ffmpeg could not remux the file")
+    rules = member_rules(task)
+    if rules and os.path.exists(download_path):
+        # Only the ZIP headers are rewritten, in place of the rename; an archive that cannot be is renamed as is
+        with timed("zip"):
+            try:
+                renamed = await asyncio.to_thread(
+                    rename_members, download_path, workspace.output_path(task["new_name"]),
+                    lambda name: member_filename(name, rules)
+                )
+                os.remove(download_path)
+                await safe_edit_message(status_message, f"🗜️ Renamed {renamed} file(s) inside the archive...")
+            except ValueError as e:
+                print(f"Files inside the archive of job {job.id} were not renamed: {e}")
+    with timed("move"):
+        new_file_path = workspace.publish(task["new_name"])
+    if not os.path.exists(new_file_path):
+        checkpoint.delete()
+        raise FileNotFoundError("The downloaded file is missing, it will be downloaded again")
+
+    file_type = task["file_type"]
+    meta = task.get("media_meta") or {}
+    generated_thumbnail = None
+
+    # Probe the file for what Telegram did not send: thumbnail, duration, dimensions, tags
+    if MEDIA_PROBE and file_type in ("video", "audio") and (
+        (file_type == "video" and not thumbnail_path) or not meta.get("duration")
+    ):
+        with timed("probe"):
+            info = await media_inspector.inspect(
+                new_file_path,
+                thumbnail=file_type == "video" and not thumbnail_path
+            )
+        if info:
+            meta = dict(meta)
+            for key in ("duration", "width", "height"):
+                meta[key] = meta.get(key) or info[key]
+            meta["performer"] = meta.get("performer") or info["artist"]
+            meta["title"] = meta.get("title") or info["title"]
+            if file_type == "video" and not thumbnail_path:
+                generated_thumbnail = info["thumbnail"]
+    if tags:
+        meta = tagged_meta(meta, tags)
+
+    upload_size = os.path.getsize(new_file_path)
+    reset_progress(job.id, upload_size)
+    async with scheduler.transmission():
+        with timed("upload", upload_size):
+            uploaded = await upload_file(
+                client,
+                new_file_path,
+                task["new_name"],
+                checkpoint,
+                progress=create_progress_callback(job.id, "Uploading"),
+                pool=member.sessions,
+                connections=UPLOAD_CONNECTIONS,
+                owner=member.name
+            )
+        try:
+            with timed("send"):
+                return await send_uploaded_media(
+                    client, chat_id, file_type, uploaded, task["new_name"],
+                    caption=build_caption(task),
+                    thumb_path=thumbnail_path or generated_thumbnail,
+                    meta=meta
+                )
+        except FilePartMissing:
+            # The server dropped the saved parts; upload everything again on the next attempt
+            checkpoint.reset_upload()
+            raise
+
+async def transfer_with(client: Client, member, job, thumbnail_path, relayed):
+    """Transfer a job's file on a pool client and return the message sent to the user.
+
+    Helpers cannot see the user's chat: the main client copies the source into
+    HELPER_CHANNEL for them (once per helper, remembered in `relayed`), and copies
+    their upload from there to the user.
+    """
+    if job.task.get("join_parts"):
+        # process_file holds the main client for joins; they are not relayed
+        return await join_process(member, job, thumbnail_path)
+    if job.task.get("split_size"):
+        run = split_process
+    elif in_memory(job.task):
+        run = memory_process
+    elif retag_format(job.task) or (STREAM_MODE and not rewrites_file(job.task)):
+        run = stream_process
+    else:
+        # Other rewrites need the whole file on disk
+        run = transfer_file
+    if member.is_main:
+        return await run(member, job, thumbnail_path, job.task["file_id"], job.user_id)
+
+    if member.name not in relayed:
+        copy = await client.copy_message(HELPER_CHANNEL, job.user_id, job.task["message_id"])
+        relayed[member.name] = copy.id
+    source = await member.client.get_messages(HELPER_CHANNEL, relayed[member.name])
+    uploaded = await run(member, job, thumbnail_path, sent_file_id(source), HELPER_CHANNEL)
+    if uploaded is None:
+        # Split files were relayed part by part
+        return None
+    sent = await client.copy_message(job.user_id, HELPER_CHANNEL, uploaded.id)
+    await discard_relayed(client, [uploaded.id])
+    return sent
+
+async def discard_relayed(client: Client, message_ids):
+    """Delete relayed messages from the helper channel"""
+    try:
+        await client.delete_messages(HELPER_CHANNEL, message_ids)
+    except Exception as e:
+        print(f"Could not clean up the helper channel: {e}")
+
+def sent_file_key(task, thumb):
+    """Key of a task's upload in the sent file cache, or None when it is not cached"""
+    # Split files go out as several messages, which are not cached
+    return SentFileCache.key(
+        None if task.get("split_size") else task.get("file_unique_id"),
+        task["new_name"],
+        ThumbnailCache.key(*thumb) if thumb else None,
+        media_tags(task) or member_rules(task)
+    )
+
+async def resend_cached(client: Client, job, key):
+    """Resend an earlier upload of the same file, name and thumbnail; False if there is none or it expired"""
+    file_id = sent_files.get(key)
+    if not file_id:
+        return False
+    try:
+        with timed("resend"):
+            await client.send_cached_media(job.user_id, file_id, caption=build_caption(job.task))
+    except BadRequest as e:
+        print(f"Cached upload for job {job.id} could not be resent: {e}")
+        sent_files.discard(key)
+        return False
+    sent_files.hits += 1
+    return True
+
+async def process_file(client: Client, job):
+    """The main function to download, rename, and upload the file of a queued job."""
+    task = job.task
+    status_message = job.status_message
     
-    progress_data[user_id] = {
+    progress_data[job.id] = {
         'status_message': status_message,
         'start_time': time.time(),
         'current': 0,
         'total': task.get('file_size', 1),
         'last_update': time.time(),
-        'last_display_update': 0,
         'last_current': 0,
         'last_time': time.time()
     }
     
-    original_file_path = None
+    thumb = task_thumbnail(task)
     thumbnail_path = None
-    new_file_path = None
+    keep_files = False
+    relayed = {}   # helper name -> id of the source copy in HELPER_CHANNEL
+    result_key = sent_file_key(task, thumb)
+    STAGE_SECONDS.observe(time.time() - job.created_at, stage="queue_wait")
     
     try:
-        await safe_edit_message(status_message, "Downloading...")
-        
-        download_callback = create_progress_callback(user_id, "Downloading")
-        
-        download_path = f"downloads/{user_id}_{int(time.time())}"
-        os.makedirs("downloads", exist_ok=True)
-        
-        original_file_path = await client.download_media(
-            message=task["file_id"],
-            file_name=download_path,
-            progress=download_callback
-        )
-        
-        if not os.path.exists(download_path):
-            await safe_edit_message(status_message, "❌ Failed to download the file.")
-            return
+        # Admitted on an otherwise idle disk that is still too small for the file
+        shortfall = -disk_reservations.available()
+        if shortfall > 0 and not in_memory(task) and not sent_files.get(result_key):
+            raise OSError(f"Not enough disk space, {humanbytes(shortfall)} more needed")
 
-        # Download thumbnail if provided
-        if task.get("thumbnail_id"):
-            thumbnail_path = await client.download_media(task["thumbnail_id"])
-        elif permanent_thumbnail:
-            thumbnail_path = await client.download_media(permanent_thumbnail['thumbnail_id'])
+        # Custom or permanent thumbnail, served from the local cache when possible
+        if thumb:
+            with timed("thumbnail"):
+                thumbnail_path = await thumb_cache.acquire(client, *thumb)
 
-        await safe_edit_message(status_message, "✅ Download complete. Preparing to upload...")
-        
-        new_file_path = os.path.join(os.path.dirname(download_path), task["new_name"])
-        shutil.move(download_path, new_file_path)
-
-        # Create caption
-        caption_parts = []
-        if task.get("prefix"):
-            caption_parts.append(f"**Prefix:** `{task['prefix']}`")
-        if task.get("suffix"):
-            caption_parts.append(f"**Suffix:** `{task['suffix']}`")
-        if task.get("base_filename"):
-            caption_parts.append(f"**Filename:** `{task['base_filename']}`")
-        
-        caption = f"📁 **Renamed to:** `{task['new_name']}`"
-        if caption_parts:
-            caption += "\n" + " | ".join(caption_parts)
-        
-        file_type = task["file_type"]
-        
-        file_size = os.path.getsize(new_file_path)
-        progress_data[user_id].update({
-            'start_time': time.time(),
-            'current': 0,
-            'total': file_size,
-            'last_update': time.time(),
-            'last_display_update': 0,
-            'last_current': 0,
-            'last_time': time.time()
-        })
-        
-        upload_callback = create_progress_callback(user_id, "Uploading")
-        
-        upload_params = {
-            'chat_id': user_id,
-            'caption': caption,
-            'progress': upload_callback,
-            'thumb': thumbnail_path,
-        }
-        
-        if file_type == "document":
-            await client.send_document(
-                document=new_file_path,
-                **upload_params
-            )
-        elif file_type == "video":
-            media = await client.get_messages(user_id, task["message_id"])
-            video_meta = media.video
-            await client.send_video(
-                video=new_file_path,
-                duration=video_meta.duration,
-                width=video_meta.width,
-                height=video_meta.height,
-                **upload_params
-            )
-        elif file_type == "audio":
-            await client.send_audio(
-                audio=new_file_path,
-                **upload_params
-            )
+        attempt = 0
+        while True:
+            member = None
+            try:
+                if await resend_cached(client, job, result_key):
+                    break
+                # The parts of a join are only reachable by the main client
+                async with client_pool.use(main=bool(task.get("join_parts"))) as member:
+                    sent = await transfer_with(client, member, job, thumbnail_path, relayed)
+                if job.id not in tag_failures:
+                    # An upload without the tags must not be resent for the tagged rename
+                    sent_files.put(result_key, sent_file_id(sent))
+                break
+            except FloodWait as e:
+                record_flood_wait("transfer", e.value)
+                attempt += 1
+                if attempt > MAX_RETRIES:
+                    raise
+                await safe_edit_message(
+                    status_message,
+                    f"⏳ Rate limited for {e.value} seconds, resuming (retry {attempt}/{MAX_RETRIES})..."
+                )
+                if member:
+                    # The next attempt waits for this client or moves to another one
+                    client_pool.cool_down(member, e.value)
+                else:
+                    await asyncio.sleep(e.value)
+            except (ConnectionError, TimeoutError, InternalServerError, FilePartMissing, FileNotFoundError) as e:
+                ERRORS.inc(type=type(e).__name__)
+                attempt += 1
+                if attempt > MAX_RETRIES:
+                    raise
+                delay = min(60, 2 ** attempt)
+                await safe_edit_message(
+                    status_message,
+                    f"⚠️ Transfer interrupted ({e}), resuming in {delay} seconds (retry {attempt}/{MAX_RETRIES})..."
+                )
+                await asyncio.sleep(delay)
 
-        await safe_edit_message(status_message, "✅ Task completed successfully!")
+        if job.id in tag_failures and task.get("tags"):
+            await safe_edit_message(
+                status_message, "✅ Task completed, but the title/artist tags could not be written into the file."
+            )
+        else:
+            await safe_edit_message(status_message, "✅ Task completed successfully!")
+        JOBS.inc(outcome="done")
 
+    except asyncio.CancelledError:
+        if job.status == "cancelling":
+            JOBS.inc(outcome="cancelled")
+            await safe_edit_message(status_message, f"🛑 Job `{job.id}` was cancelled.")
+        else:
+            # The bot is shutting down: keep partial files so the job can resume
+            keep_files = True
+        raise
     except FloodWait as e:
-        await safe_edit_message(status_message, f"⏳ Please wait {e.value} seconds due to rate limits...")
-        await asyncio.sleep(e.value)
+        JOBS.inc(outcome="failed")
+        await safe_edit_message(status_message, f"❌ Still rate limited after {MAX_RETRIES} retries ({e.value}s).")
     except Exception as e:
+        ERRORS.inc(type=type(e).__name__)
+        JOBS.inc(outcome="failed")
         await safe_edit_message(status_message, f"❌ An error occurred: {str(e)}")
         print(f"Error: {e}")
     finally:
-        try:
-            if original_file_path and os.path.exists(original_file_path):
-                os.remove(original_file_path)
-            if new_file_path and os.path.exists(new_file_path):
-                os.remove(new_file_path)
-            if thumbnail_path and os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
-        except Exception as e:
-            print(f"Error cleaning up files: {e}")
+        if not keep_files:
+            job_workspace(job).remove()
+        if relayed:
+            await discard_relayed(client, list(relayed.values()))
         
-        if user_id in progress_data:
-            del progress_data[user_id]
-        if user_id in user_tasks:
-            del user_tasks[user_id]
-        if user_id in thumbnail_requests:
-            del thumbnail_requests[user_id]
+        if thumbnail_path:
+            thumb_cache.release(*thumb)
+        if job.id in progress_data:
+            del progress_data[job.id]
+        tag_failures.discard(job.id)
+
+async def process_remote(job):
+    """Run a job in a worker process and relay its status texts to the job's message."""
+    task = dict(job.task)
+    # Workers do not know the permanent thumbnail, hand it over with the task
+    thumb = task_thumbnail(task)
+    if thumb:
+        task["thumbnail_id"], task["thumbnail_unique_id"] = thumb
+    result_key = sent_file_key(task, thumb)
+
+    def on_event(event):
+        if event["event"] == "parts_sent":
+            record_parts_sent(job, event["count"])
+        else:
+            progress_renderer.submit(job.status_message, event["text"])
+
+    try:
+        if await resend_cached(app, job, result_key):
+            await safe_edit_message(job.status_message, "✅ Task completed successfully!")
+            return
+        await worker_pool.run(
+            job.id,
+            {"user_id": job.user_id, "task": task, "created_at": job.created_at},
+            on_event,
+            cancelled=lambda: job.status == "cancelling"
+        )
+    except asyncio.CancelledError:
+        if job.status == "cancelling":
+            await safe_edit_message(job.status_message, f"🛑 Job `{job.id}` was cancelled.")
+        raise
+    except Exception as e:
+        await safe_edit_message(job.status_message, f"❌ An error occurred: {str(e)}")
+        print(f"Error: {e}")
+
+async def restore_jobs(client: Client):
+    """Re-queue jobs that were queued or running when the bot last stopped."""
+    for job_id in sorted(stored_jobs):
+        record = stored_jobs[job_id]
+        user_id = record["user_id"]
+        try:
+            status_message = await client.get_messages(user_id, record["status_message_id"])
+            if not status_message or status_message.empty:
+                raise ValueError("status message is gone")
+        except Exception:
+            status_message = await client.send_message(
+                user_id,
+                "Restoring job...",
+                reply_to_message_id=record["task"]["message_id"]
+            )
+            record["status_message_id"] = status_message.id
+            stored_jobs[job_id] = record
+        scheduler.submit(user_id, record["task"], status_message, job_id=job_id)
+        await safe_edit_message(
+            status_message,
+            f"♻️ **Job** `{job_id}` **restored after a restart**, it will resume where it stopped.\n"
+            f"`{record['task']['new_name']}`"
+        )
+    if stored_jobs:
+        print(f"♻️ Restored {len(stored_jobs)} job(s)")
+
+async def main():
+    """Start the client and the job workers, then wait until the bot is stopped."""
+    await web_server.start()
+    print("🌐 Web server started")
+    await app.start()
+    if worker_pool:
+        await worker_pool.start()
+    else:
+        await client_pool.start()
+    state_store.start()
+    progress_renderer.start()
+    await restore_jobs(app)
+    removed = await janitor.sweep()
+    if removed:
+        print(f"🧹 Removed {removed} orphaned download(s)")
+    janitor.start()
+    scheduler.start()
+    print(f"✅ Bot is running successfully! ({WORKERS} workers, {WORKER_PROCESSES or 'no'} worker processes)")
+    await idle()
+    await janitor.stop()
+    await scheduler.stop()
+    if worker_pool:
+        await worker_pool.stop()
+    await progress_renderer.stop()
+    await state_store.stop()
+    await client_pool.stop()
+    await app.stop()
+    await web_server.stop()
 
 # --- Start the bot and web server ---
 if __name__ == "__main__":
     print(f"🤖 Bot is starting on port {PORT}...")
     
-    # Create necessary directories
-    os.makedirs("downloads", exist_ok=True)
-    
-    # Start Flask web server in a separate thread
-    try:
-        web_thread = Thread(target=run_web_server)
-        web_thread.daemon = True
-        web_thread.start()
-        print("🌐 Web server started")
-    except Exception as e:
-        print(f"❌ Web server failed to start: {e}")
-    
     print("🔌 Connecting Telegram bot...")
     
     # Run the Pyrogram bot
     try:
-        app.run()
-        print("✅ Bot is running successfully!")
+        app.run(main())
     except Exception as e:
         print(f"❌ Bot failed to start: {e}")
     
@@ -0,0 +1,81 @@
+import os
+import json
+import time
+
+
+class TransferCheckpoint:
+    """JSON sidecar recording how far the download and upload of a job got.
+
+    `downloaded` is the number of bytes flushed to the download file by the sequential
+    downloader, `download_chunks` the 1 MiB ranges finished by the parallel one, `upload_id`
+    and `upload_parts` identify the parts Telegram already acknowledged for the
+    upload, which only `upload_owner`, the client that saved them, can continue.
+    save() writes at most once per `interval` seconds unless forced.
+    """
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.downloaded = 0
+        self.download_complete = False
+        self.download_chunks = set()
+        self.upload_id = None
+        self.upload_total = 0
+        self.upload_parts = set()
+        self.upload_owner = None
+        self._last_save = 0
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                self.downloaded = data.get("downloaded", 0)
+                self.download_complete = data.get("download_complete", False)
+                self.download_chunks = set(data.get("download_chunks", []))
+                self.upload_id = data.get("upload_id")
+                self.upload_total = data.get("upload_total", 0)
+                self.upload_parts = set(data.get("upload_parts", []))
+                self.upload_owner = data.get("upload_owner")
+            except (OSError, ValueError):
+                pass
+
+    def start_upload(self, upload_id, total_parts, owner=None):
+        """Begin a new upload unless `owner` can continue one with the same part count."""
+        if self.upload_id is None or self.upload_total != total_parts or self.upload_owner != owner:
+            self.upload_id = upload_id
+            self.upload_total = total_parts
+            self.upload_parts = set()
+            self.upload_owner = owner
+        return self.upload_id
+
+    def reset_upload(self):
+        self.upload_id = None
+        self.upload_total = 0
+        self.upload_parts = set()
+        self.upload_owner = None
+        self.save(force=True)
+
+    def due(self):
+        """Whether the throttle interval has passed since the last save."""
+        return time.monotonic() - self._last_save >= self.interval
+
+    def save(self, force=False):
+        if not force and not self.due():
+            return
+        self._last_save = time.monotonic()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "downloaded": self.downloaded,
+                "download_complete": self.download_complete,
+                "download_chunks": sorted(self.download_chunks),
+                "upload_id": self.upload_id,
+                "upload_total": self.upload_total,
+                "upload_parts": sorted(self.upload_parts),
+                "upload_owner": self.upload_owner
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def delete(self):
+        for path in (self.path, self.path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,115 @@
+import os
+import asyncio
+from collections import deque
+
+
+class ChunkBuffer:
+    """Bounded FIFO of downloaded bytes that spills to disk once the memory budget is used up.
+
+    One producer calls put() while one consumer calls read(). Spill writes and reads
+    run in threads with positional I/O, so they never share a file position, and
+    the spill file is only rewound when nothing written to it is still unread or
+    being written.
+    """
+
+    def __init__(self, max_memory, spill_path):
+        self.max_memory = max_memory
+        self.spill_path = spill_path
+        self.memory_used = 0
+        self.spilled_bytes = 0
+        self._entries = deque()  # bytes kept in memory or (offset, length) inside the spill file
+        self._spill_fd = None
+        self._spill_end = 0
+        self._pending_spill = 0  # spilled bytes not yet read, including writes still in flight
+        self._closed = False
+        self._error = None
+        self._ready = asyncio.Event()
+
+    async def put(self, chunk):
+        """Append a chunk, writing it to the spill file when the memory budget is full."""
+        if not chunk:
+            return
+        if self.memory_used + len(chunk) <= self.max_memory:
+            self._entries.append(bytes(chunk))
+            self.memory_used += len(chunk)
+        else:
+            # Claim the region before awaiting, so a concurrent read cannot rewind over it
+            offset = self._spill_end
+            self._spill_end += len(chunk)
+            self._pending_spill += len(chunk)
+            await asyncio.to_thread(self._write_spill, offset, bytes(chunk))
+            self._entries.append((offset, len(chunk)))
+            self.spilled_bytes += len(chunk)
+        self._ready.set()
+
+    def close(self):
+        """Mark the end of the stream."""
+        self._closed = True
+        self._ready.set()
+
+    def fail(self, error):
+        """Propagate a producer error to the reader."""
+        self._error = error
+        self._ready.set()
+
+    async def read(self, size):
+        """Read exactly `size` bytes, or fewer only at the end of the stream."""
+        parts = []
+        needed = size
+        while needed > 0:
+            if self._error:
+                raise self._error
+            if not self._entries:
+                if self._closed:
+                    break
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            entry = self._entries[0]
+            if isinstance(entry, bytes):
+                data = entry[:needed]
+                if len(entry) > needed:
+                    self._entries[0] = entry[needed:]
+                else:
+                    self._entries.popleft()
+                self.memory_used -= len(data)
+            else:
+                offset, length = entry
+                take = min(length, needed)
+                data = await asyncio.to_thread(self._read_spill, offset, take)
+                if length > take:
+                    self._entries[0] = (offset + take, length - take)
+                else:
+                    self._entries.popleft()
+                self._pending_spill -= take
+                if self._pending_spill == 0:
+                    # Everything on disk has been consumed and no write is in flight, reuse the file
+                    self._spill_end = 0
+
+            parts.append(data)
+            needed -= len(data)
+        return b"".join(parts)
+
+    def cleanup(self):
+        """Close and remove the spill file."""
+        if self._spill_fd is not None:
+            os.close(self._spill_fd)
+            self._spill_fd = None
+        if os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+
+    def _write_spill(self, offset, chunk):
+        if self._spill_fd is None:
+            self._spill_fd = os.open(self.spill_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        view = memoryview(chunk)
+        while view:
+            written = os.pwrite(self._spill_fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def _read_spill(self, offset, length):
+        data = os.pread(self._spill_fd, length, offset)
+        if len(data) < length:
+            raise IOError(f"Spill file ended after {len(data)} of {length} bytes")
+        return data
@@ -0,0 +1,75 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class PoolMember:
+    """One client of the pool with its media sessions and load."""
+
+    def __init__(self, name, client, sessions, is_main=False):
+        self.name = name
+        self.client = client
+        self.sessions = sessions
+        self.is_main = is_main
+        self.active = 0
+        self.cooldown_until = 0
+
+    @property
+    def cooldown(self):
+        """Seconds left until this client may transfer again."""
+        return max(0, self.cooldown_until - time.monotonic())
+
+
+class ClientPool:
+    """The main client plus helper clients that share the download and upload work.
+
+    use() hands out the least loaded client that is not cooling down from a FloodWait,
+    so a flood limit on one session moves the next transfers to the others. When
+    every client is cooling down, it waits for the one that is ready first. Only
+    helpers are started and stopped here; the main client also runs the chat.
+    """
+
+    def __init__(self, main, main_sessions, helpers=()):
+        self.members = [PoolMember("main", main, main_sessions, is_main=True)]
+        for n, (client, sessions) in enumerate(helpers, 1):
+            self.members.append(PoolMember(f"helper_{n}", client, sessions))
+
+    def __len__(self):
+        return len(self.members)
+
+    @property
+    def has_helpers(self):
+        return len(self.members) > 1
+
+    def pick(self):
+        ready = [m for m in self.members if not m.cooldown]
+        if ready:
+            # Ties go to the main client, which needs no relaying
+            return min(ready, key=lambda m: (m.active, not m.is_main))
+        return min(self.members, key=lambda m: m.cooldown_until)
+
+    @asynccontextmanager
+    async def use(self, main=False):
+        """Hold the least loaded available client, or the main one if `main`, for one transfer."""
+        member = self.members[0] if main else self.pick()
+        member.active += 1
+        try:
+            if member.cooldown:
+                await asyncio.sleep(member.cooldown)
+            yield member
+        finally:
+            member.active -= 1
+
+    def cool_down(self, member, seconds):
+        member.cooldown_until = max(member.cooldown_until, time.monotonic() + seconds)
+
+    async def start(self):
+        for member in self.members:
+            if not member.is_main:
+                await member.client.start()
+
+    async def stop(self):
+        for member in self.members:
+            await member.sessions.stop()
+            if not member.is_main:
+                await member.client.stop()
@@ -0,0 +1,51 @@
+import psutil
+from workspace import disk_usage
+
+
+class DiskReservations:
+    """Disk space promised to jobs that download into `root`.
+
+    A reservation covers what a job still has to write: its size minus what its
+    workspace already holds, so partial downloads are not counted twice against
+    the free space reported by the filesystem. `headroom` bytes are always kept free.
+    """
+
+    def __init__(self, root, headroom=0):
+        self.root = root
+        self.headroom = headroom
+        self._reservations = {}
+
+    def __len__(self):
+        return len(self._reservations)
+
+    def free(self):
+        return psutil.disk_usage(self.root).free
+
+    def outstanding(self):
+        """Bytes the reserved jobs are still going to write."""
+        return sum(max(0, size - disk_usage(path)) for size, path in self._reservations.values())
+
+    @property
+    def reserved(self):
+        return sum(size for size, _ in self._reservations.values())
+
+    def available(self):
+        """Free bytes not yet promised to a job, after the headroom."""
+        return self.free() - self.outstanding() - self.headroom
+
+    def try_reserve(self, key, size, path):
+        """Reserve `size` bytes for a job writing below `path`.
+
+        Fails while other reservations hold the space the job needs, since waiting for
+        them helps; a job that does not fit even on an otherwise idle disk is let
+        through so the caller can report it instead of queueing it forever.
+        """
+        if key in self._reservations:
+            return True
+        if self._reservations and size - disk_usage(path) > self.available():
+            return False
+        self._reservations[key] = (size, path)
+        return True
+
+    def release(self, key):
+        self._reservations.pop(key, None)
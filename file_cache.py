@@ -0,0 +1,144 @@
+import os
+import json
+import time
+from collections import OrderedDict
+
+
+def sent_file_id(message):
+    """file_id of the document, video or audio in a sent message, if any."""
+    media = message and (message.document or message.video or message.audio)
+    return media.file_id if media else None
+
+
+class SentFileCache:
+    """file_ids of finished uploads, keyed by source file, final name and thumbnail.
+
+    Renaming the same source to the same name with the same thumbnail again only
+    has to resend the stored file_id. Entries live in a persistent mapping and the
+    oldest are dropped beyond `max_entries`.
+    """
+
+    def __init__(self, mapping, max_entries=1000):
+        self.mapping = mapping
+        self.max_entries = max_entries
+        self.hits = 0
+
+    @staticmethod
+    def key(unique_id, name, thumb_key=None, tags=None):
+        if not unique_id:
+            return None
+        return json.dumps([unique_id, name, thumb_key] + ([tags] if tags else []), sort_keys=True)
+
+    def get(self, key):
+        entry = self.mapping.get(key) if key else None
+        return entry["file_id"] if entry else None
+
+    def put(self, key, file_id):
+        if not key or not file_id:
+            return
+        self.mapping[key] = {"file_id": file_id, "time": time.time()}
+        excess = len(self.mapping) - self.max_entries
+        if excess > 0:
+            for old in sorted(self.mapping, key=lambda k: self.mapping[k]["time"])[:excess]:
+                del self.mapping[old]
+
+    def discard(self, key):
+        self.mapping.pop(key, None)
+
+
+class SourceCache:
+    """Recently downloaded source files, kept as hardlinks and keyed by file_unique_id.
+
+    A job renaming a file that is still cached links it into its workspace instead
+    of downloading it again. Entries expire `ttl` seconds after they were stored and
+    the least recently used are evicted beyond `max_bytes`; 0 disables the cache.
+    The directory must be on the same filesystem as the workspaces.
+    """
+
+    def __init__(self, directory="source_cache", max_bytes=0, ttl=3600):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.size = 0
+        self._entries = OrderedDict()
+
+        if max_bytes:
+            os.makedirs(self.directory, exist_ok=True)
+            files = sorted(
+                (
+                    path for path in (os.path.join(self.directory, f) for f in os.listdir(self.directory))
+                    # Worker processes keep their caches in subdirectories
+                    if os.path.isfile(path) and not path.endswith(".link")
+                ),
+                key=os.path.getmtime
+            )
+            for path in files:
+                self._entries[os.path.basename(path)] = (path, os.path.getsize(path), os.path.getmtime(path))
+                self.size += os.path.getsize(path)
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, unique_id, path):
+        """Keep a finished download; skipped when it cannot be hardlinked."""
+        if not self.max_bytes or not unique_id:
+            return
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            return
+        self._drop(unique_id)
+        target = os.path.join(self.directory, unique_id)
+        try:
+            _link(path, target)
+        except OSError:
+            return
+        self._entries[unique_id] = (target, size, time.time())
+        self.size += size
+        self._evict()
+
+    def link_to(self, unique_id, size, target):
+        """Hardlink a cached source of `size` bytes to `target`; False on a miss."""
+        self._evict()
+        entry = self._entries.get(unique_id) if unique_id else None
+        if not entry:
+            return False
+        path, cached_size, _ = entry
+        if cached_size != size:
+            self._drop(unique_id)
+            return False
+        try:
+            _link(path, target)
+        except OSError:
+            self._drop(unique_id)
+            return False
+        self._entries.move_to_end(unique_id)
+        self.hits += 1
+        return True
+
+    def _drop(self, unique_id):
+        entry = self._entries.pop(unique_id, None)
+        if entry:
+            self.size -= entry[1]
+            try:
+                os.remove(entry[0])
+            except OSError:
+                pass
+
+    def _evict(self):
+        now = time.time()
+        for unique_id, (_, _, stored_at) in list(self._entries.items()):
+            if now - stored_at > self.ttl:
+                self._drop(unique_id)
+        while self.size > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+
+
+def _link(source, target):
+    """Atomically make `target` another name of `source`, replacing whatever is there."""
+    tmp = target + ".link"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    os.link(source, tmp)
+    os.replace(tmp, target)
@@ -15,30 +15,60 @@ def get_media_from_message(message: Message):
             return getattr(message, attr)
 
 
-# Get media info (thumbnail, duration, etc.)
-def get_media_info(path):
+# Attributes of a received video/audio/document needed to re-upload it as-is
+def get_media_meta(file_type, media):
+    meta = {
+        "duration": getattr(media, "duration", 0) or 0,
+        "width": getattr(media, "width", 0) or 0,
+        "height": getattr(media, "height", 0) or 0,
+        "mime_type": getattr(media, "mime_type", None),
+        "performer": None,
+        "title": None,
+        "supports_streaming": None
+    }
+    if file_type == "video":
+        meta["supports_streaming"] = bool(getattr(media, "supports_streaming", False))
+    elif file_type == "audio":
+        meta["performer"] = getattr(media, "performer", None)
+        meta["title"] = getattr(media, "title", None)
+    return meta
+
+
+# Turn ffprobe JSON output into the media info dict used by the bot
+def parse_probe(probe):
     info = {
         "thumbnail": None,
         "duration": 0,
         "width": 0,
         "height": 0,
         "artist": None,
-        "title": None
+        "title": None,
+        "tags": {},
+        "streams": probe.get("streams", []),
+        "format": probe.get("format", {})
     }
-    try:
-        metadata = ffmpeg.probe(path)["format"]
-        if "tags" in metadata:
-            if "artist" in metadata["tags"]:
-                info["artist"] = metadata["tags"]["artist"]
-            if "title" in metadata["tags"]:
-                info["title"] = metadata["tags"]["title"]
+    tags = {k.lower(): v for k, v in info["format"].get("tags", {}).items()}
+    info["tags"] = tags
+    info["artist"] = tags.get("artist")
+    info["title"] = tags.get("title")
 
-        video_stream = next((s for s in ffmpeg.probe(path)["streams"] if s["codec_type"] == "video"), None)
-        if video_stream:
-            info["duration"] = int(float(video_stream["duration"]))
-            info["width"] = int(video_stream["width"])
-            info["height"] = int(video_stream["height"])
-            
+    duration = info["format"].get("duration")
+    video_stream = next((s for s in info["streams"] if s.get("codec_type") == "video"), None)
+    if video_stream:
+        duration = video_stream.get("duration") or duration
+        info["width"] = int(video_stream.get("width") or 0)
+        info["height"] = int(video_stream.get("height") or 0)
+    if duration:
+        info["duration"] = int(float(duration))
+    return info
+
+
+# Get media info (thumbnail, duration, etc.)
+def get_media_info(path):
+    info = parse_probe({})
+    try:
+        info = parse_probe(ffmpeg.probe(path))
+        if info["width"]:
             # Generate thumbnail
             thumb_path = f"thumbnails/{os.path.basename(path)}.jpg"
             ffmpeg.input(path, ss=info["duration"] / 2).filter('scale', 320, -1).output(thumb_path, vframes=1).run(overwrite_output=True)
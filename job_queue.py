@@ -0,0 +1,235 @@
+import time
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class RenameJob:
+    """A rename request waiting in, or being worked on by, the scheduler."""
+
+    def __init__(self, job_id, user_id, task, status_message=None):
+        self.id = job_id
+        self.user_id = user_id
+        self.task = task
+        self.status_message = status_message
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.runner = None
+
+    @property
+    def name(self):
+        return self.task.get("new_name") or self.task.get("original_filename", "")
+
+    @property
+    def size(self):
+        return self.task.get("file_size") or 0
+
+    @property
+    def priority(self):
+        """Set by the admin; jobs of a higher priority always start first."""
+        return self.task.get("priority", 0)
+
+
+class JobScheduler:
+    """Runs rename jobs on a pool of worker tasks.
+
+    The next job is chosen by, in this order: the job's priority; the user's fair
+    share, i.e. the estimated run time of the user's started jobs divided by
+    `weight(user_id)`, so a user with a 4 GB video and one with small files take
+    turns; and the highest response ratio (waiting time + run time) / run time, so
+    small jobs go first while a large job gains on them the longer it waits and is
+    never starved. Run times are estimated as `overhead` seconds plus the file size
+    at `rate` bytes per second.
+    A separate semaphore caps how many downloads/uploads run at the same time.
+
+    Job ids count up from `first_id`; restored jobs keep theirs.
+
+    `admit(job)` may hold back the best job of a user, e.g. until there is disk space
+    for it; the user's other jobs then wait behind it. Held jobs stay queued and are
+    retried whenever a job is submitted or finishes, or every `admit_retry` seconds
+    for resources freed outside the bot.
+    """
+
+    def __init__(self, handler, workers=4, max_transmissions=4, on_done=None, admit=None, admit_retry=30,
+                 weight=None, rate=10 * 1024 * 1024, overhead=2, first_id=1):
+        self.handler = handler
+        self.on_done = on_done
+        self.admit = admit
+        self.admit_retry = admit_retry
+        self.weight = weight
+        self.rate = rate
+        self.overhead = overhead
+        self.workers = workers
+        self.max_transmissions = max_transmissions
+        self.jobs = {}
+        self._ids = itertools.count(first_id)
+        self._queues = {}
+        self._service = {}  # user id -> weighted estimated run time of the user's started jobs
+        self._queued = asyncio.Queue()
+        self._transmissions = None
+        self._workers = []
+        self._capacity = asyncio.Event()
+
+    def start(self):
+        """Spawn the worker tasks on the running event loop."""
+        if self._workers:
+            return
+        self._transmissions = asyncio.Semaphore(self.max_transmissions)
+        for _ in range(self.workers):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        """Cancel the workers and any running jobs."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, user_id, task, status_message=None, job_id=None):
+        """Queue a configured task and return its RenameJob.
+
+        `job_id` is only given when re-queueing a job restored from storage.
+        """
+        if job_id is None:
+            job_id = next(self._ids)
+        elif job_id >= self._peek_id():
+            self._ids = itertools.count(job_id + 1)
+        job = RenameJob(job_id, user_id, task, status_message)
+        self.jobs[job.id] = job
+        if user_id not in self._queues:
+            # A user (re)joining starts level with the others instead of claiming back idle time
+            self._service[user_id] = min(self._service.values(), default=0)
+            self._queues[user_id] = deque()
+        self._queues[user_id].append(job)
+        self._queued.put_nowait(job.id)
+        # Workers waiting on a held job would otherwise not see this one before admit_retry
+        self.wake()
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns the job or None if unknown."""
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+        if job.status == "queued":
+            self._queues[job.user_id].remove(job)
+            self._forget(job, "cancelled")
+        elif job.runner:
+            job.status = "cancelling"
+            job.runner.cancel()
+        return job
+
+    def user_jobs(self, user_id):
+        """Jobs of a user in the order they would be worked on now."""
+        running = [j for j in self.jobs.values() if j.user_id == user_id and j.status == "running"]
+        now = time.time()
+        return running + sorted(self._queues.get(user_id, ()), key=lambda job: self._rank(job, now))
+
+    def position(self, job):
+        """1-based position of a queued job among its user's queued jobs, as ranked now."""
+        queue = self._queues.get(job.user_id, ())
+        if job not in queue:
+            return 0
+        now = time.time()
+        rank = self._rank(job, now)
+        return sum(1 for other in queue if self._rank(other, now) < rank) + 1
+
+    def estimate(self, job):
+        """Estimated run time of a job in seconds."""
+        return self.overhead + job.size / self.rate
+
+    @property
+    def queued_count(self):
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def running_count(self):
+        return sum(1 for j in self.jobs.values() if j.status == "running")
+
+    @asynccontextmanager
+    async def transmission(self):
+        """Hold one of the global transfer slots for the duration of a download/upload."""
+        async with self._transmissions:
+            yield
+
+    def wake(self):
+        """Make workers retry queued jobs that admit() held back."""
+        self._capacity.set()
+        self._capacity = asyncio.Event()
+
+    def _rank(self, job, now):
+        """Sort key of a job among its user's jobs: priority, then highest response ratio."""
+        run_time = self.estimate(job)
+        waited = max(0, now - job.created_at)
+        return -job.priority, -(waited + run_time) / run_time, job.id
+
+    def _pick_next(self):
+        """Pop the best ranked job that is admitted."""
+        now = time.time()
+        held = set()
+        ranked = sorted(
+            (job for queue in self._queues.values() for job in queue),
+            key=lambda job: (-job.priority, self._service[job.user_id], self._rank(job, now))
+        )
+        for job in ranked:
+            if job.user_id in held:
+                continue
+            if self.admit is None or self.admit(job):
+                self._queues[job.user_id].remove(job)
+                weight = self.weight(job.user_id) if self.weight else 1
+                self._service[job.user_id] += self.estimate(job) / max(weight, 0.01)
+                return job
+            held.add(job.user_id)
+        return None
+
+    def _peek_id(self):
+        next_id = next(self._ids)
+        self._ids = itertools.count(next_id)
+        return next_id
+
+    def _forget(self, job, status, notify=True):
+        job.status = status
+        self.jobs.pop(job.id, None)
+        if notify and self.on_done:
+            self.on_done(job)
+        self.wake()
+        queue = self._queues.get(job.user_id)
+        if queue is not None and not queue and not any(
+            j.user_id == job.user_id for j in self.jobs.values()
+        ):
+            del self._queues[job.user_id]
+            del self._service[job.user_id]
+
+    async def _worker(self):
+        while True:
+            await self._queued.get()
+            capacity = self._capacity
+            job = self._pick_next()
+            if not job:
+                if self.queued_count:
+                    # Jobs are waiting but none was admitted; keep the token and retry later
+                    self._queued.put_nowait(None)
+                    try:
+                        await asyncio.wait_for(capacity.wait(), timeout=self.admit_retry)
+                    except asyncio.TimeoutError:
+                        pass
+                # Otherwise the job this token belonged to was cancelled while queued
+                continue
+
+            job.status = "running"
+            job.started_at = time.time()
+            job.runner = asyncio.create_task(self.handler(job))
+            try:
+                await job.runner
+                self._forget(job, "done")
+            except asyncio.CancelledError:
+                if job.status != "cancelling":
+                    # The worker itself is being stopped, the job is only interrupted
+                    self._forget(job, "interrupted", notify=False)
+                    raise
+                self._forget(job, "cancelled")
+            except Exception as e:
+                self._forget(job, "failed")
+                print(f"Job {job.id} failed: {e}")
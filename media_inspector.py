@@ -0,0 +1,224 @@
+import os
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from helper_fns import parse_probe
+
+SAMPLE_SIZE = 1024 * 1024
+PIPE_CHUNK_SIZE = 1024 * 1024
+# Muxers that write their tags up front and never seek back, so they can write to a pipe
+STREAM_FORMATS = {".mkv": "matroska", ".mka": "matroska", ".webm": "webm", ".mp3": "mp3"}
+
+
+def file_fingerprint(path):
+    """Cheap content hash: size plus the first and last MiB of the file."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(SAMPLE_SIZE))
+        if size > SAMPLE_SIZE:
+            f.seek(max(SAMPLE_SIZE, size - SAMPLE_SIZE))
+            digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def stream_format(source_name, target_name):
+    """ffmpeg muxer that can retag `source_name` into `target_name` through pipes, or None.
+
+    Both ends must be streamable: demuxing an MP4 from a pipe fails unless its index
+    happens to come first, and an MP4 cannot be written to one.
+    """
+    source_ext = os.path.splitext(source_name or "")[1].lower()
+    target_ext = os.path.splitext(target_name or "")[1].lower()
+    if source_ext not in STREAM_FORMATS:
+        return None
+    return STREAM_FORMATS.get(target_ext)
+
+
+class RetagError(Exception):
+    """ffmpeg is missing or could not remux the stream."""
+
+
+class RetagStream:
+    """Output of an ffmpeg process copying every stream from its stdin to its stdout."""
+
+    def __init__(self, proc, read_input):
+        self._proc = proc
+        self._feeder = asyncio.create_task(self._feed(read_input))
+        self._errors = asyncio.create_task(proc.stderr.read())
+
+    async def read(self, size):
+        """Read exactly `size` bytes, or fewer only at the end of the output.
+
+        The end of the output is only returned once ffmpeg exited cleanly, so a failed
+        remux raises RetagError here instead of passing for a short file.
+        """
+        try:
+            return await self._proc.stdout.readexactly(size)
+        except asyncio.IncompleteReadError as e:
+            data = e.partial
+        # Errors of the input, e.g. a failed download, are the cause of any ffmpeg error
+        await self._feeder
+        code = await self._proc.wait()
+        if code != 0:
+            error = (await self._errors).decode(errors="replace").strip()
+            raise RetagError(error.splitlines()[-1] if error else f"ffmpeg exited with code {code}")
+        return data
+
+    async def close(self):
+        """Stop ffmpeg if it is still running and wait for it."""
+        self._feeder.cancel()
+        if self._proc.returncode is None:
+            try:
+                self._proc.kill()
+            except ProcessLookupError:
+                pass
+        await self._proc.wait()
+        await asyncio.gather(self._feeder, self._errors, return_exceptions=True)
+
+    async def _feed(self, read_input):
+        stdin = self._proc.stdin
+        try:
+            while True:
+                chunk = await read_input(PIPE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                stdin.write(chunk)
+                await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg stopped reading, its exit code tells why
+            pass
+        finally:
+            stdin.close()
+
+
+class MediaInspector:
+    """Async ffprobe/ffmpeg front-end.
+
+    Each file is probed once with ffprobe running as an asyncio subprocess, a thumbnail
+    is rendered with a keyframe seek (-ss before -i), and results are cached by
+    file_fingerprint() so the same content is never probed twice. retag() and
+    retag_stream() rewrite container tags with stream copy only, the latter on bytes
+    piped through ffmpeg. At most `max_concurrent` ffmpeg processes run at a time.
+    """
+
+    def __init__(self, max_concurrent=2, thumb_dir="thumbnails/generated", cache_size=256,
+                 ffprobe="ffprobe", ffmpeg="ffmpeg"):
+        self.thumb_dir = os.path.abspath(thumb_dir)
+        self.cache_size = cache_size
+        self.ffprobe = ffprobe
+        self.ffmpeg = ffmpeg
+        self._limit = asyncio.Semaphore(max_concurrent)
+        self._cache = OrderedDict()
+        os.makedirs(self.thumb_dir, exist_ok=True)
+
+    async def inspect(self, path, thumbnail=True):
+        """Return the media info dict of a file (see helper_fns.parse_probe), or None if it can't be probed."""
+        key = await asyncio.to_thread(file_fingerprint, path)
+        info = self._cache.get(key)
+        if info is None:
+            probe = await self._probe(path)
+            if probe is None:
+                return None
+            info = parse_probe(probe)
+            self._remember(key, info)
+        else:
+            self._cache.move_to_end(key)
+
+        if thumbnail and info["width"] and not (info["thumbnail"] and os.path.exists(info["thumbnail"])):
+            info["thumbnail"] = await self._render_thumbnail(path, key, info["duration"])
+        return info
+
+    async def retag(self, source, target, tags):
+        """Write `source` to `target` with new container tags, copying every stream as is.
+
+        The output format follows the extension of `target`. Returns False, leaving
+        nothing at `target`, when ffmpeg is missing or cannot remux the file.
+        """
+        directory, name = os.path.split(target)
+        partial = os.path.join(directory, f".partial-{name}")
+        code, _ = await self._run(*self._retag_args(source, tags), partial)
+        if code != 0 or not os.path.exists(partial):
+            if os.path.exists(partial):
+                os.remove(partial)
+            return False
+        os.replace(partial, target)
+        return True
+
+    @asynccontextmanager
+    async def retag_stream(self, read_input, tags, format_name):
+        """Pipe the bytes of `read_input(size)` through ffmpeg with new container tags.
+
+        Yields a RetagStream of the output, written as `format_name` (see
+        stream_format()), so the retagged file is never written to disk. Its size is
+        only known at the end. Raises RetagError when ffmpeg is missing.
+        """
+        async with self._limit:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *self._retag_args("pipe:0", tags), "-f", format_name, "pipe:1",
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+            except FileNotFoundError:
+                raise RetagError(f"{self.ffmpeg} not found")
+            stream = RetagStream(proc, read_input)
+            try:
+                yield stream
+            finally:
+                await stream.close()
+
+    def _retag_args(self, source, tags):
+        args = [self.ffmpeg, "-v", "error", "-y", "-i", source, "-map", "0", "-c", "copy", "-map_metadata", "0"]
+        for key, value in tags.items():
+            args += ["-metadata", f"{key}={value}"]
+        return args
+
+    async def _run(self, *args):
+        async with self._limit:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+            except FileNotFoundError:
+                print(f"Media inspection unavailable: {args[0]} not found")
+                return None, None
+            stdout, stderr = await proc.communicate()
+            return proc.returncode, stdout
+
+    async def _probe(self, path):
+        code, stdout = await self._run(
+            self.ffprobe, "-v", "error", "-print_format", "json",
+            "-show_format", "-show_streams", path
+        )
+        if code != 0:
+            return None
+        try:
+            return json.loads(stdout)
+        except ValueError:
+            return None
+
+    async def _render_thumbnail(self, path, key, duration):
+        thumb_path = os.path.join(self.thumb_dir, f"{key}.jpg")
+        code, _ = await self._run(
+            self.ffmpeg, "-v", "error", "-y",
+            "-ss", str(duration / 2 if duration else 0),
+            "-i", path,
+            "-frames:v", "1", "-vf", "scale=320:-1",
+            thumb_path
+        )
+        if code != 0 or not os.path.exists(thumb_path):
+            return None
+        return thumb_path
+
+    def _remember(self, key, info):
+        self._cache[key] = info
+        while len(self._cache) > self.cache_size:
+            _, old = self._cache.popitem(last=False)
+            if old["thumbnail"] and os.path.exists(old["thumbnail"]):
+                os.remove(old["thumbnail"])
@@ -0,0 +1,142 @@
+import time
+import bisect
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+SPEED_BUCKETS = tuple(2 ** n * 1024 for n in range(6, 19, 2))  # 64 KiB/s .. 256 MiB/s
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(34), "")}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self._values.items():
+            yield f"{self.name}{_labels(self.label_names, key)} {value}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus text format."""
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.label_names = tuple(labels)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _labels(self.label_names + ("le",), key + (le,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, key)} {total}"
+            yield f"{self.name}_count{_labels(self.label_names, key)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self):
+        for metric in self.metrics:
+            yield from metric.collect()
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rename_stage_duration_seconds",
+    "Time spent in each stage of a rename job",
+    SECONDS_BUCKETS,
+    labels=("stage",)
+))
+STAGE_SPEED = REGISTRY.register(Histogram(
+    "rename_stage_speed_bytes_per_second",
+    "Transfer speed of the download and upload stages",
+    SPEED_BUCKETS,
+    labels=("stage",)
+))
+STAGE_BYTES = REGISTRY.register(Counter(
+    "rename_stage_bytes_total",
+    "Bytes moved by each transfer stage",
+    labels=("stage",)
+))
+FLOOD_WAITS = REGISTRY.register(Counter(
+    "telegram_flood_waits_total",
+    "FloodWait errors received",
+    labels=("source",)
+))
+FLOOD_WAIT_SECONDS = REGISTRY.register(Counter(
+    "telegram_flood_wait_seconds_total",
+    "Seconds Telegram asked us to wait",
+    labels=("source",)
+))
+ERRORS = REGISTRY.register(Counter(
+    "rename_errors_total",
+    "Errors raised while processing rename jobs",
+    labels=("type",)
+))
+STATUS_EDITS = REGISTRY.register(Counter(
+    "status_edits_total",
+    "Status message edits sent to Telegram"
+))
+JOBS = REGISTRY.register(Counter(
+    "rename_jobs_total",
+    "Finished rename jobs by outcome",
+    labels=("outcome",)
+))
+
+
+@contextmanager
+def timed(stage, size=None):
+    """Record the duration, and the speed if `size` bytes were moved, of a pipeline stage."""
+    start = time.monotonic()
+    yield
+    elapsed = time.monotonic() - start
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+    if size:
+        STAGE_BYTES.inc(size, stage=stage)
+        if elapsed > 0:
+            STAGE_SPEED.observe(size / elapsed, stage=stage)
+
+
+def record_flood_wait(source, seconds):
+    FLOOD_WAITS.inc(source=source)
+    FLOOD_WAIT_SECONDS.inc(seconds, source=source)
@@ -0,0 +1,118 @@
+import time
+import asyncio
+from collections import OrderedDict
+from pyrogram.errors import FloodWait
+from metrics import STATUS_EDITS, record_flood_wait
+
+
+class ProgressRenderer:
+    """Single task that performs every status message edit.
+
+    Callers submit the newest text (or a callable producing it) for a message and
+    return immediately. Only the latest frame per message is kept, so frames that
+    were superseded before they could be sent are dropped. Edits are paced per chat
+    (`chat_interval` seconds between edits in the same chat) and globally
+    (`global_rate` edits per second). A FloodWait puts only that chat on cooldown and
+    stretches the pacing interval, which then relaxes again after successful edits.
+    """
+
+    def __init__(self, chat_interval=3.0, global_rate=20, max_interval=60.0):
+        self.chat_interval = chat_interval
+        self.global_interval = 1.0 / global_rate
+        self.max_interval = max_interval
+        self.edits_sent = 0
+        self.frames_dropped = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self._interval = chat_interval
+        self._frames = OrderedDict()
+        self._last_text = OrderedDict()
+        self._chat_ready = {}
+        self._global_ready = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def submit(self, message, text):
+        """Queue the latest text (str or zero-argument callable) for a message."""
+        key = (message.chat.id, message.id)
+        if key in self._frames:
+            self.frames_dropped += 1
+        self._frames[key] = (message, text)
+        self._wakeup.set()
+
+    @property
+    def pending(self):
+        return len(self._frames)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the render task."""
+        if not self._task:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def _next_frame(self, now):
+        """The oldest frame whose chat may be edited now, or the time to wait until one can."""
+        earliest = None
+        for key in self._frames:
+            ready_at = self._chat_ready.get(key[0], 0)
+            if ready_at <= now:
+                return key, 0
+            earliest = ready_at if earliest is None else min(earliest, ready_at)
+        return None, (earliest - now if earliest is not None else None)
+
+    async def _run(self):
+        while True:
+            if not self._frames:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            if self._global_ready > now:
+                await asyncio.sleep(self._global_ready - now)
+                continue
+
+            key, delay = self._next_frame(now)
+            if key is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            message, text = self._frames.pop(key)
+            if callable(text):
+                text = text()
+            if not text or self._last_text.get(key) == text:
+                continue
+
+            self._global_ready = now + self.global_interval
+            self._chat_ready[key[0]] = now + self._interval
+            try:
+                await message.edit_text(text=text)
+                self._last_text[key] = text
+                self._last_text.move_to_end(key)
+                if len(self._last_text) > 1000:
+                    self._last_text.popitem(last=False)
+                self.edits_sent += 1
+                STATUS_EDITS.inc()
+                self._interval = max(self.chat_interval, self._interval * 0.9)
+            except FloodWait as e:
+                print(f"Flood wait: edits to chat {key[0]} paused for {e.value} seconds")
+                self.flood_waits += 1
+                self.flood_wait_seconds += e.value
+                record_flood_wait("status_edit", e.value)
+                self._chat_ready[key[0]] = time.monotonic() + e.value
+                self._interval = min(self.max_interval, self._interval * 2)
+                # Retry the frame later unless a newer one arrived meanwhile
+                if key not in self._frames:
+                    self._frames[key] = (message, text)
+            except Exception:
+                pass
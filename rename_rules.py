@@ -0,0 +1,118 @@
+import re
+from functools import lru_cache
+
+INVALID_CHARS = '<>:"/\\|?*'
+_STRIP_INVALID = str.maketrans("", "", INVALID_CHARS)
+CASES = {"lower": str.lower, "upper": str.upper, "title": str.title}
+
+
+def sanitize_filename(filename):
+    """Remove invalid characters from filename"""
+    return filename.translate(_STRIP_INVALID).strip()
+
+
+def _unquote(value):
+    """Strip a value, keeping what is inside matching quotes so spaces can be given."""
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+    return value
+
+
+def split_extension(filename):
+    """Split a filename at its last dot into base name and lowercased extension with the dot."""
+    base, dot, ext = filename.rpartition(".")
+    if not dot:
+        return filename, ""
+    return base, "." + ext.lower()
+
+
+class RenamePreset:
+    """Saved rename rules, one per line:
+
+    replace: <regex> => <replacement>   substitution on the name without extension
+    case: lower|upper|title             applied after the substitutions
+    prefix: <text> / suffix: <text>     added around the name
+    ext: <from> => <to>                 extension mapping, `*` matches any extension
+
+    Values may be quoted to keep leading or trailing spaces. Substitutions run in
+    the order given. Presets are compiled once by compile_preset() and can then be
+    applied to any number of names.
+    """
+
+    def __init__(self, text):
+        self.text = text.strip()
+        self.substitutions = []
+        self.case = None
+        self.prefix = ""
+        self.suffix = ""
+        self.extensions = {}
+
+        for number, line in enumerate(self.text.splitlines(), 1):
+            line = line.strip()
+            if not line:
+                continue
+            kind, colon, value = line.partition(":")
+            kind = kind.strip().lower()
+            if not colon:
+                raise ValueError(f"Line {number}: expected `<rule>: <value>`")
+            if kind == "replace":
+                pattern, arrow, replacement = value.partition("=>")
+                if not arrow or not pattern.strip():
+                    raise ValueError(f"Line {number}: use `replace: <regex> => <replacement>`")
+                try:
+                    compiled = re.compile(pattern.strip())
+                    # Also checks the group references of the replacement
+                    compiled.sub(_unquote(replacement), "")
+                except re.error as e:
+                    raise ValueError(f"Line {number}: invalid regex: {e}")
+                self.substitutions.append((compiled, _unquote(replacement)))
+            elif kind == "case":
+                self.case = value.strip().lower()
+                if self.case not in CASES:
+                    raise ValueError(f"Line {number}: case must be one of {', '.join(CASES)}")
+            elif kind == "prefix":
+                self.prefix = _unquote(value)
+            elif kind == "suffix":
+                self.suffix = _unquote(value)
+            elif kind == "ext":
+                source, arrow, target = value.partition("=>")
+                if not arrow or not source.strip() or not target.strip():
+                    raise ValueError(f"Line {number}: use `ext: <from> => <to>`")
+                self.extensions[source.strip().lstrip(".").lower()] = target.strip().lstrip(".").lower()
+            else:
+                raise ValueError(f"Line {number}: unknown rule `{kind}`")
+
+        if not (self.substitutions or self.case or self.prefix or self.suffix or self.extensions):
+            raise ValueError("The preset has no rules")
+
+    def apply(self, original_name):
+        """The new name of a file, or ValueError when the rules leave nothing of it."""
+        base, ext = split_extension(original_name)
+        for pattern, replacement in self.substitutions:
+            base = pattern.sub(replacement, base)
+        if self.case:
+            base = CASES[self.case](base)
+
+        ext = ext[1:]
+        target = self.extensions.get(ext, self.extensions.get("*", ext))
+        name = sanitize_filename(f"{self.prefix}{base}{self.suffix}" + (f".{target}" if target else ""))
+        if not split_extension(name)[0]:
+            raise ValueError(f"The rules leave no name for `{original_name}`")
+        return name
+
+    def preview(self, names):
+        """Dry-run the preset: (original, new name or None, error or None) per name."""
+        results = []
+        for name in names:
+            try:
+                results.append((name, self.apply(name), None))
+            except ValueError as e:
+                results.append((name, None, str(e)))
+        return results
+
+
+@lru_cache(maxsize=256)
+def compile_preset(text):
+    """Parse and compile preset rules; identical texts share one compiled preset."""
+    return RenamePreset(text)
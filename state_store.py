@@ -0,0 +1,158 @@
+import json
+import asyncio
+import sqlite3
+from collections.abc import MutableMapping
+
+
+class StateStore:
+    """Key/value state backend, organised in namespaces.
+
+    Reads are served from memory; writes only mark keys dirty and are persisted by
+    flush(), which the background task from start() calls every `flush_interval`
+    seconds, so the bot never waits on storage in its hot path.
+    """
+
+    def __init__(self, flush_interval=0.5):
+        self.flush_interval = flush_interval
+        self._data = {}
+        self._dirty = set()
+        self._task = None
+
+    def load(self, namespace):
+        """Return the stored items of a namespace as a dict."""
+        return dict(self._data.get(namespace, {}))
+
+    def get(self, namespace, key, default=None):
+        return self._data.get(namespace, {}).get(key, default)
+
+    def set(self, namespace, key, value):
+        self._data.setdefault(namespace, {})[key] = value
+        self._dirty.add((namespace, key))
+
+    def delete(self, namespace, key):
+        self._data.get(namespace, {}).pop(key, None)
+        self._dirty.add((namespace, key))
+
+    def mapping(self, namespace, key_type=str):
+        return PersistentMap(self, namespace, key_type)
+
+    async def flush(self):
+        """Write all dirty keys to the backend."""
+        self._dirty.clear()
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._dirty:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    print(f"State store flush failed: {e}")
+
+
+class MemoryStateStore(StateStore):
+    """State that lives only as long as the process."""
+
+
+class SQLiteStateStore(StateStore):
+    """State persisted in a SQLite database in WAL mode, written in batches."""
+
+    def __init__(self, path, flush_interval=0.5):
+        super().__init__(flush_interval)
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._db.commit()
+        for namespace, key, value in self._db.execute("SELECT namespace, key, value FROM state"):
+            self._data.setdefault(namespace, {})[key] = json.loads(value)
+        self._lock = asyncio.Lock()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            upserts = []
+            deletes = []
+            for namespace, key in dirty:
+                values = self._data.get(namespace, {})
+                if key in values:
+                    upserts.append((namespace, key, json.dumps(values[key])))
+                else:
+                    deletes.append((namespace, key))
+            try:
+                await asyncio.to_thread(self._write, upserts, deletes)
+            except Exception:
+                self._dirty |= dirty
+                raise
+
+    def _write(self, upserts, deletes):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+                upserts
+            )
+            self._db.executemany("DELETE FROM state WHERE namespace = ? AND key = ?", deletes)
+
+    async def stop(self):
+        await super().stop()
+        self._db.close()
+
+
+class PersistentMap(MutableMapping):
+    """Dict view of one namespace of a StateStore.
+
+    Values must be JSON serialisable. Changes made inside a stored value are not
+    seen until the key is assigned again.
+    """
+
+    def __init__(self, store, namespace, key_type=str):
+        self.store = store
+        self.namespace = namespace
+        self.key_type = key_type
+
+    def __getitem__(self, key):
+        values = self.store._data.get(self.namespace, {})
+        if str(key) not in values:
+            raise KeyError(key)
+        return values[str(key)]
+
+    def __setitem__(self, key, value):
+        self.store.set(self.namespace, str(key), value)
+
+    def __delitem__(self, key):
+        if str(key) not in self.store._data.get(self.namespace, {}):
+            raise KeyError(key)
+        self.store.delete(self.namespace, str(key))
+
+    def __iter__(self):
+        return (self.key_type(k) for k in list(self.store._data.get(self.namespace, {})))
+
+    def __len__(self):
+        return len(self.store._data.get(self.namespace, {}))
+
+
+def open_state_store(url):
+    """Open a backend from a URL: `sqlite:///path/to/db` (default) or `memory://`."""
+    if url.startswith("memory://"):
+        return MemoryStateStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStateStore(url[len("sqlite:///"):])
+    return SQLiteStateStore(url)
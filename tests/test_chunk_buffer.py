@@ -0,0 +1,114 @@
+import os
+import random
+import asyncio
+
+from chunk_buffer import ChunkBuffer
+
+
+async def round_trip(tmp_path, data, max_memory, chunk_sizes, read_sizes, seed):
+    rng = random.Random(seed)
+    buffer = ChunkBuffer(max_memory, str(tmp_path / "buffer.spill"))
+
+    async def produce():
+        pos = 0
+        while pos < len(data):
+            size = rng.choice(chunk_sizes)
+            await buffer.put(data[pos:pos + size])
+            pos += size
+            if rng.random() < 0.3:
+                await asyncio.sleep(0)
+        buffer.close()
+
+    async def consume():
+        parts = []
+        while True:
+            chunk = await buffer.read(rng.choice(read_sizes))
+            if not chunk:
+                return b"".join(parts)
+            parts.append(chunk)
+            if rng.random() < 0.3:
+                await asyncio.sleep(0)
+
+    producer = asyncio.create_task(produce())
+    try:
+        result = await consume()
+        await producer
+    finally:
+        buffer.cleanup()
+    return buffer, result
+
+
+def test_concurrent_round_trip_with_spilling(tmp_path):
+    data = os.urandom(2 * 1024 * 1024)
+    for seed in range(20):
+        buffer, result = asyncio.run(round_trip(
+            tmp_path, data, 4096, [1024, 4096, 65536, 100000], [512 * 1024, 3000, 70000], seed
+        ))
+        assert result == data, f"stream corrupted with seed {seed}"
+        assert buffer.spilled_bytes > 0
+    assert not os.path.exists(tmp_path / "buffer.spill")
+
+
+def test_round_trip_in_memory(tmp_path):
+    data = os.urandom(300000)
+    buffer, result = asyncio.run(round_trip(tmp_path, data, len(data), [4096, 65536], [512 * 1024], 0))
+    assert result == data
+    assert buffer.spilled_bytes == 0
+
+
+def test_producer_error_reaches_reader(tmp_path):
+    async def run():
+        buffer = ChunkBuffer(16, str(tmp_path / "buffer.spill"))
+        await buffer.put(b"x" * 64)
+        buffer.fail(IOError("download failed"))
+        try:
+            await buffer.read(128)
+        finally:
+            buffer.cleanup()
+
+    try:
+        asyncio.run(run())
+    except IOError as e:
+        assert str(e) == "download failed"
+    else:
+        raise AssertionError("the producer error was not raised")
+
+
+def test_split_and_join_read_patterns(tmp_path):
+    """Parts fed in one after the other (join) and read back in upload-sized parts (split)."""
+    part_size = 512 * 1024
+    sources = [os.urandom(3 * part_size + 1234), os.urandom(part_size), os.urandom(77777)]
+    data = b"".join(sources)
+    split_size = 2 * part_size
+
+    async def run():
+        buffer = ChunkBuffer(8192, str(tmp_path / "buffer.spill"))
+
+        async def produce():
+            for source in sources:
+                for pos in range(0, len(source), 100000):
+                    await buffer.put(source[pos:pos + 100000])
+                    await asyncio.sleep(0)
+            buffer.close()
+
+        producer = asyncio.create_task(produce())
+        parts = []
+        try:
+            for start in range(0, len(data), split_size):
+                size = min(split_size, len(data) - start)
+                chunks = []
+                while size > 0:
+                    chunk = await buffer.read(min(part_size, size))
+                    assert chunk
+                    chunks.append(chunk)
+                    size -= len(chunk)
+                parts.append(b"".join(chunks))
+            assert await buffer.read(part_size) == b""
+            await producer
+        finally:
+            buffer.cleanup()
+        return parts
+
+    parts = asyncio.run(run())
+    assert [len(p) for p in parts[:-1]] == [split_size] * (len(parts) - 1)
+    assert b"".join(parts) == data
@@ -0,0 +1,122 @@
+import time
+import asyncio
+
+from job_queue import JobScheduler
+
+MB = 1024 * 1024
+
+
+def task(name, size_mb, **fields):
+    return dict(fields, new_name=name, file_size=size_mb * MB)
+
+
+async def start_order(submissions, waited=None, timeout=5, **options):
+    """Submit (user, task) pairs before the workers start and return the names in start order.
+
+    `waited` maps names to how many seconds their jobs have already been queued.
+    """
+    started = []
+
+    async def handler(job):
+        started.append(job.name)
+        await asyncio.sleep(0)
+
+    scheduler = JobScheduler(handler, workers=1, rate=MB, overhead=2, **options)
+    for user_id, job_task in submissions:
+        job = scheduler.submit(user_id, job_task)
+        job.created_at -= (waited or {}).get(job.name, 0)
+    scheduler.start()
+    deadline = time.monotonic() + timeout
+    while scheduler.jobs and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    await scheduler.stop()
+    return started
+
+
+def test_shortest_job_first():
+    order = asyncio.run(start_order([
+        (1, task("large", 100)),
+        (1, task("small", 1)),
+        (1, task("medium", 10)),
+    ]))
+    assert order == ["small", "medium", "large"]
+
+
+def test_waiting_jobs_age_past_smaller_ones():
+    # (1000 s waited + 102 s run time) / 102 s beats a new job's ratio of 1
+    order = asyncio.run(start_order(
+        [(1, task("small", 1)), (1, task("large", 100))],
+        waited={"large": 1000}
+    ))
+    assert order == ["large", "small"]
+
+
+def test_users_take_turns():
+    order = asyncio.run(start_order([
+        (1, task("a1", 5)),
+        (1, task("a2", 5)),
+        (1, task("a3", 5)),
+        (2, task("b1", 5)),
+        (2, task("b2", 5)),
+    ]))
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_weighted_fair_share():
+    # User 1 is weighted 3, so its started jobs count a third against its share
+    order = asyncio.run(start_order(
+        [(1, task(f"a{n}", 5)) for n in range(1, 5)] + [(2, task(f"b{n}", 5)) for n in range(1, 3)],
+        weight=lambda user_id: 3 if user_id == 1 else 1
+    ))
+    assert order[:4] == ["a1", "b1", "a2", "a3"]
+
+
+def test_priority_overrides_size_and_share():
+    order = asyncio.run(start_order([
+        (1, task("a1", 1)),
+        (1, task("a2", 1)),
+        (2, task("urgent", 500, priority=1)),
+    ]))
+    assert order == ["urgent", "a1", "a2"]
+
+
+def test_held_job_holds_back_its_user_only():
+    admitted = set()
+
+    def admit(job):
+        # "big" is held until another job has run
+        if job.name == "big" and not admitted:
+            return False
+        admitted.add(job.name)
+        return True
+
+    order = asyncio.run(start_order([
+        (1, task("big", 1)),
+        (1, task("later", 5)),
+        (2, task("other", 5)),
+    ], admit=admit))
+    assert order == ["other", "big", "later"]
+
+
+def test_submitted_job_starts_while_another_is_held():
+    async def run():
+        started = {}
+
+        async def handler(job):
+            started[job.name] = time.monotonic()
+
+        scheduler = JobScheduler(
+            handler, workers=2, admit=lambda job: job.name != "held", admit_retry=5
+        )
+        scheduler.start()
+        scheduler.submit(1, task("held", 1))
+        # Let every worker take the held job's token and wait for capacity
+        await asyncio.sleep(0.2)
+        submitted = time.monotonic()
+        scheduler.submit(2, task("fits", 1))
+        while "fits" not in started and time.monotonic() - submitted < 6:
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+        return started.get("fits", float("inf")) - submitted
+
+    assert asyncio.run(run()) < 1
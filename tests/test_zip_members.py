@@ -0,0 +1,133 @@
+import io
+import struct
+import zipfile
+
+import pytest
+
+from zip_members import rename_members, END_SIGNATURE
+
+FILES = {
+    "a.txt": b"alpha " * 1000,
+    "docs/": b"",
+    "docs/b.txt": b"bravo",
+    "docs/über.txt": b"utf-8 name",
+    "cafX.txt": b"cp437 name",
+}
+
+
+class Unseekable:
+    """Write-only stream, so zipfile falls back to data descriptors."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+
+def build_archive(data_descriptors=False, comment=b"archive comment"):
+    target = Unseekable() if data_descriptors else io.BytesIO()
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.comment = comment
+        for name, data in FILES.items():
+            if name.endswith("/"):
+                zf.writestr(zipfile.ZipInfo(name), b"")
+            else:
+                zf.writestr(name, data)
+    raw = (target.buffer if data_descriptors else target).getvalue()
+    # zipfile writes names that are not ASCII as UTF-8; patch one into a cp437 name without the flag
+    return raw.replace(b"cafX.txt", b"caf\x82.txt")
+
+
+def expected_contents():
+    contents = {}
+    for name, data in FILES.items():
+        contents[name.replace("cafX", "café")] = data
+    return contents
+
+
+def renamed(name):
+    return name.replace(".txt", "-new.txt")
+
+
+@pytest.mark.parametrize("data_descriptors", [False, True])
+def test_rename_round_trip(tmp_path, data_descriptors):
+    source = tmp_path / "in.zip"
+    target = tmp_path / "out.zip"
+    source.write_bytes(build_archive(data_descriptors))
+    with zipfile.ZipFile(source) as zf:
+        assert all(bool(info.flag_bits & 0x08) == data_descriptors for info in zf.infolist() if info.file_size)
+        assert "café.txt" in zf.namelist()
+
+    assert rename_members(str(source), str(target), renamed) == 4
+
+    with zipfile.ZipFile(target) as zf:
+        assert zf.testzip() is None
+        assert zf.comment == b"archive comment"
+        assert zf.namelist() == [renamed(name) for name in expected_contents()]
+        for name, data in expected_contents().items():
+            assert zf.read(renamed(name)) == data
+        infos = {info.filename: info for info in zf.infolist()}
+    assert infos["docs/"].is_dir()
+    assert not infos["a-new.txt"].flag_bits & 0x800
+    assert infos["docs/über-new.txt"].flag_bits & 0x800
+    assert infos["café-new.txt"].flag_bits & 0x800
+    assert not list(tmp_path.glob(".partial-*"))
+
+
+def test_unchanged_names_keep_the_archive_valid(tmp_path):
+    source = tmp_path / "in.zip"
+    target = tmp_path / "out.zip"
+    source.write_bytes(build_archive(comment=b""))
+    assert rename_members(str(source), str(target), lambda name: name) == 0
+    with zipfile.ZipFile(target) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == sorted(expected_contents())
+
+
+def zip64_archive(monkeypatch):
+    # Lowering the member limit makes zipfile write real ZIP64 end records for two members
+    monkeypatch.setattr(zipfile, "ZIP_FILECOUNT_LIMIT", 1)
+    target = io.BytesIO()
+    with zipfile.ZipFile(target, "w") as zf:
+        zf.writestr("a.txt", b"a")
+        zf.writestr("b.txt", b"b")
+    return target.getvalue()
+
+
+def multi_volume_archive(monkeypatch):
+    raw = build_archive()
+    pos = raw.rfind(END_SIGNATURE)
+    return raw[:pos + 4] + struct.pack("<H", 1) + raw[pos + 6:]
+
+
+def prefixed_archive(monkeypatch):
+    # Like a self-extracting archive: a stub in front of the ZIP structure
+    return b"MZ stub" * 100 + build_archive()
+
+
+@pytest.mark.parametrize("make, error", [
+    (zip64_archive, "ZIP64"),
+    (multi_volume_archive, "Multi-volume"),
+    (prefixed_archive, "data before"),
+])
+def test_unsupported_archives_leave_the_target_untouched(tmp_path, monkeypatch, make, error):
+    source = tmp_path / "in.zip"
+    target = tmp_path / "out.zip"
+    source.write_bytes(make(monkeypatch))
+    target.write_bytes(b"previous")
+    with pytest.raises(ValueError, match=error):
+        rename_members(str(source), str(target), renamed)
+    assert target.read_bytes() == b"previous"
+    assert not list(tmp_path.glob(".partial-*"))
+
+
+def test_not_a_zip(tmp_path):
+    source = tmp_path / "in.zip"
+    source.write_bytes(b"not an archive")
+    with pytest.raises(ValueError, match="Not a ZIP"):
+        rename_members(str(source), str(tmp_path / "out.zip"), renamed)
+    assert not (tmp_path / "out.zip").exists()
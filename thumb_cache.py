@@ -0,0 +1,101 @@
+import os
+import asyncio
+import hashlib
+from collections import OrderedDict, Counter
+
+
+class ThumbnailCache:
+    """Local copies of Telegram thumbnails, content-addressed by file_unique_id.
+
+    The permanent thumbnail is pinned and only replaced when it changes; per-task
+    thumbnails are kept in LRU order and evicted beyond `max_entries`. Entries handed
+    out by acquire() are not evicted until they are released again.
+    """
+
+    def __init__(self, directory="thumbnails", max_entries=32):
+        self.directory = os.path.abspath(directory)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pinned = None
+        self._in_use = Counter()
+        self._locks = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        files = sorted(
+            (f for f in os.listdir(self.directory) if f.endswith(".jpg")),
+            key=lambda f: os.path.getmtime(os.path.join(self.directory, f))
+        )
+        for name in files:
+            self._entries[name[:-4]] = os.path.join(self.directory, name)
+
+    @staticmethod
+    def key(file_id, unique_id=None):
+        """Cache key of a thumbnail; older records without a unique id fall back to the file id."""
+        return unique_id or hashlib.sha1(file_id.encode()).hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def acquire(self, client, file_id, unique_id=None):
+        """Return a local path for the thumbnail, downloading it only on a cache miss."""
+        key = self.key(file_id, unique_id)
+        self._in_use[key] += 1
+        try:
+            return await self._fetch(client, file_id, key)
+        except Exception:
+            self.release(file_id, unique_id)
+            raise
+
+    def release(self, file_id, unique_id=None):
+        """Give back a path obtained from acquire()."""
+        key = self.key(file_id, unique_id)
+        self._in_use[key] -= 1
+        if self._in_use[key] <= 0:
+            del self._in_use[key]
+        self._evict()
+
+    async def set_permanent(self, client, file_id, unique_id=None):
+        """Pin a new permanent thumbnail, fetching it once, and unpin the previous one."""
+        key = self.key(file_id, unique_id)
+        self._pinned = key
+        await self._fetch(client, file_id, key)
+        self._evict()
+
+    def pin(self, file_id, unique_id=None):
+        """Mark an already known thumbnail as permanent without fetching it."""
+        self._pinned = self.key(file_id, unique_id) if file_id else None
+        self._evict()
+
+    async def _fetch(self, client, file_id, key):
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            path = self._entries.get(key)
+            if path and os.path.exists(path):
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return path
+
+            self.misses += 1
+            path = await client.download_media(
+                file_id,
+                file_name=os.path.join(self.directory, f"{key}.jpg")
+            )
+            self._entries[key] = path
+            self._locks.pop(key, None)
+            return path
+
+    def _evict(self):
+        evictable = [
+            k for k in self._entries
+            if k != self._pinned and k not in self._in_use
+        ]
+        excess = len(self._entries) - self.max_entries
+        for key in evictable[:max(0, excess)]:
+            path = self._entries.pop(key)
+            self._locks.pop(key, None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
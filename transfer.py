@@ -0,0 +1,536 @@
+import os
+import math
+import asyncio
+import inspect
+import mmap
+import mimetypes
+from collections import deque
+from pyrogram import Client, raw, types, utils
+from pyrogram.errors import AuthBytesInvalid, FloodWait, InternalServerError
+from pyrogram.file_id import FileId
+from pyrogram.session import Session, Auth
+from chunk_buffer import ChunkBuffer
+
+# Telegram transfer limits
+UPLOAD_PART_SIZE = 512 * 1024
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+async def report(progress, current, total):
+    """Call a sync or async progress callback."""
+    if progress:
+        result = progress(current, total)
+        if inspect.isawaitable(result):
+            await result
+
+
+async def save_part(invoke, file_id, part, total_parts, chunk, is_big, retries=0):
+    """Upload one file part through `invoke` (client.invoke or a session's), retrying transient errors."""
+    if is_big:
+        rpc = raw.functions.upload.SaveBigFilePart(
+            file_id=file_id,
+            file_part=part,
+            file_total_parts=total_parts,
+            bytes=chunk
+        )
+    else:
+        rpc = raw.functions.upload.SaveFilePart(
+            file_id=file_id,
+            file_part=part,
+            bytes=chunk
+        )
+    for attempt in range(retries + 1):
+        try:
+            await invoke(rpc)
+            return
+        except FloodWait as e:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(e.value)
+        except (ConnectionError, TimeoutError, InternalServerError):
+            if attempt == retries:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+
+def input_file(file_id, total_parts, file_name, is_big):
+    """The InputFile referencing a finished upload."""
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+    return raw.types.InputFile(id=file_id, parts=total_parts, name=file_name, md5_checksum="")
+
+
+async def upload_stream(client: Client, read_part, file_size, file_name, progress=None):
+    """Upload a file of known size part by part from an async reader and return its InputFile."""
+    is_big = file_size > BIG_FILE_THRESHOLD
+    total_parts = max(1, math.ceil(file_size / UPLOAD_PART_SIZE))
+    file_id = client.rnd_id()
+    uploaded = 0
+
+    for part in range(total_parts):
+        chunk = await read_part(UPLOAD_PART_SIZE)
+        if not chunk:
+            raise IOError(f"Stream ended after {uploaded} of {file_size} bytes")
+        await save_part(client.invoke, file_id, part, total_parts, chunk, is_big)
+        uploaded += len(chunk)
+        await report(progress, uploaded, file_size)
+
+    return input_file(file_id, total_parts, file_name, is_big)
+
+
+async def upload_unsized_stream(client: Client, read_part, file_name, size_hint=0, progress=None):
+    """Upload a stream whose size is only known at its end and return its InputFile.
+
+    Parts are held back until the stream is larger than BIG_FILE_THRESHOLD, so a
+    short stream is still saved as a small file. A larger one is saved as a big file
+    whose parts announce -1 as the part count until the last one, as Telegram's
+    streamed uploads require. `size_hint` is only used to report progress.
+    """
+    file_id = client.rnd_id()
+    pending = deque()
+    size = 0
+    while size <= BIG_FILE_THRESHOLD:
+        chunk = await read_part(UPLOAD_PART_SIZE)
+        if not chunk:
+            break
+        pending.append(chunk)
+        size += len(chunk)
+    if not pending:
+        raise IOError("The stream is empty")
+    is_big = size > BIG_FILE_THRESHOLD
+    ended = not is_big
+    part = 0
+    uploaded = 0
+
+    while pending:
+        chunk = pending.popleft()
+        if not pending and not ended:
+            # Read one part ahead to know whether this one is the last
+            following = await read_part(UPLOAD_PART_SIZE)
+            if following:
+                pending.append(following)
+            else:
+                ended = True
+        total_parts = part + 1 + len(pending) if ended else -1
+        await save_part(client.invoke, file_id, part, total_parts, chunk, is_big)
+        part += 1
+        uploaded += len(chunk)
+        await report(progress, uploaded, max(size_hint, uploaded))
+
+    return input_file(file_id, part, file_name, is_big)
+
+
+async def upload_file(client: Client, path, file_name, checkpoint=None, progress=None,
+                      pool=None, connections=1, part_retries=3, owner=None):
+    """Upload a file from disk and return its InputFile.
+
+    The file is read through a memory-mapped view and its parts are pushed by
+    `connections` concurrent workers, each on its own media session from `pool`
+    (or the main session when no pool is given). Every part is retried on its own,
+    and parts the checkpoint lists as acknowledged are skipped. Saved parts belong to
+    the account that uploaded them, so `owner` names the client and an upload the
+    checkpoint records for another one starts over.
+    """
+    file_size = os.path.getsize(path)
+    if not file_size:
+        raise ValueError("Cannot upload an empty file")
+    is_big = file_size > BIG_FILE_THRESHOLD
+    total_parts = max(1, math.ceil(file_size / UPLOAD_PART_SIZE))
+    if checkpoint:
+        file_id = checkpoint.start_upload(client.rnd_id(), total_parts, owner)
+        done = checkpoint.upload_parts
+    else:
+        file_id = client.rnd_id()
+        done = set()
+
+    if pool and connections > 1:
+        sessions = await pool.get(await client.storage.dc_id(), connections)
+        invokers = [session.invoke for session in sessions]
+    else:
+        invokers = [client.invoke]
+
+    uploaded = sum(
+        min(UPLOAD_PART_SIZE, file_size - part * UPLOAD_PART_SIZE) for part in done
+    )
+    todo = iter([part for part in range(total_parts) if part not in done])
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        async def worker(invoke):
+            nonlocal uploaded
+            for part in todo:
+                start = part * UPLOAD_PART_SIZE
+                # Slicing may fault pages in from disk, keep that off the event loop
+                chunk = await asyncio.to_thread(view.__getitem__, slice(start, start + UPLOAD_PART_SIZE))
+                await save_part(invoke, file_id, part, total_parts, chunk, is_big, retries=part_retries)
+                uploaded += len(chunk)
+                if checkpoint:
+                    checkpoint.upload_parts.add(part)
+                    checkpoint.save()
+                await report(progress, uploaded, file_size)
+
+        workers = [asyncio.create_task(worker(invoke)) for invoke in invokers]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if checkpoint:
+                checkpoint.save(force=True)
+
+    return input_file(file_id, total_parts, file_name, is_big)
+
+
+async def resumable_download(client: Client, file_id, path, file_size, checkpoint, progress=None):
+    """Download a file with client.stream_media, continuing from the checkpointed offset."""
+    offset = checkpoint.downloaded if os.path.exists(path) else 0
+    offset = min(offset, os.path.getsize(path) if os.path.exists(path) else 0)
+    offset -= offset % STREAM_CHUNK_SIZE
+
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.truncate(offset)
+        f.seek(offset)
+        await report(progress, offset, file_size)
+        async for chunk in client.stream_media(file_id, offset=offset // STREAM_CHUNK_SIZE):
+            await asyncio.to_thread(f.write, chunk)
+            offset += len(chunk)
+            checkpoint.downloaded = offset
+            if checkpoint.due():
+                # Only record bytes that actually reached the file
+                await asyncio.to_thread(f.flush)
+                checkpoint.save(force=True)
+            await report(progress, offset, file_size)
+
+    if file_size and offset < file_size:
+        raise IOError(f"Download ended after {offset} of {file_size} bytes")
+    checkpoint.downloaded = offset
+    checkpoint.download_complete = True
+    checkpoint.save(force=True)
+    return path
+
+
+async def send_uploaded_media(client: Client, chat_id, file_type, input_file, file_name,
+                              caption="", thumb_path=None, meta=None):
+    """Send an already uploaded InputFile as document, video or audio, like client.send_* does."""
+    meta = meta or {}
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if file_type == "video":
+        attributes.insert(0, raw.types.DocumentAttributeVideo(
+            supports_streaming=None if meta.get("supports_streaming") is False else True,
+            duration=meta.get("duration") or 0,
+            w=meta.get("width") or 0,
+            h=meta.get("height") or 0
+        ))
+    elif file_type == "audio":
+        attributes.insert(0, raw.types.DocumentAttributeAudio(
+            duration=meta.get("duration") or 0,
+            performer=meta.get("performer"),
+            title=meta.get("title")
+        ))
+
+    thumb = await client.save_file(thumb_path) if thumb_path else None
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mimetypes.guess_type(file_name)[0] or meta.get("mime_type") or "application/octet-stream",
+        file=input_file,
+        thumb=thumb,
+        force_file=True if file_type == "document" else None,
+        attributes=attributes
+    )
+
+    r = await client.invoke(
+        raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=media,
+            random_id=client.rnd_id(),
+            **await utils.parse_text_entities(client, caption, None, None)
+        )
+    )
+
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                client, update.message,
+                {u.id: u for u in r.users},
+                {c.id: c for c in r.chats}
+            )
+
+
+async def stream_rename(client: Client, task, chat_id, caption, thumb_path=None, meta=None,
+                        buffer_size=64 * 1024 * 1024, spill_dir="downloads", progress=None, pipe=None):
+    """Download and re-upload a file at the same time through a bounded chunk buffer.
+
+    Chunks from client.stream_media are pushed into a ChunkBuffer while the uploader
+    drains it in upload-sized parts, so the upload starts with the first chunk instead
+    of after the whole file has been written to disk.
+
+    `pipe(read)` may rewrite the bytes on the way: an async context manager that
+    takes the buffer's reader and yields a reader of the rewritten bytes, whose size
+    is then unknown until they end.
+    """
+    file_size = task["file_size"]
+    os.makedirs(spill_dir, exist_ok=True)
+    buffer = ChunkBuffer(buffer_size, os.path.join(spill_dir, f"{chat_id}_{client.rnd_id()}.spill"))
+
+    async def produce():
+        try:
+            async for chunk in client.stream_media(task["file_id"]):
+                await buffer.put(chunk)
+            buffer.close()
+        except Exception as e:
+            buffer.fail(e)
+            raise
+
+    producer = asyncio.create_task(produce())
+    try:
+        if pipe:
+            async with pipe(buffer.read) as output:
+                input_file = await upload_unsized_stream(client, output.read, task["new_name"], file_size, progress)
+        else:
+            input_file = await upload_stream(client, buffer.read, file_size, task["new_name"], progress)
+        await producer
+        return await send_uploaded_media(
+            client, chat_id, task["file_type"], input_file, task["new_name"],
+            caption=caption, thumb_path=thumb_path, meta=meta
+        )
+    finally:
+        if not producer.done():
+            producer.cancel()
+        buffer.cleanup()
+
+
+async def split_rename(client: Client, task, chat_id, caption, names, part_size, thumb_path=None,
+                       first_part=0, on_part=None, buffer_size=64 * 1024 * 1024, spill_dir="downloads",
+                       progress=None):
+    """Stream a file too large for one upload as documents of `part_size` bytes named `names`.
+
+    Like stream_rename, every part is uploaded while it downloads, and it is sent as
+    soon as its last byte is in; `on_part(index, message)` is called after each.
+    Parts before `first_part` were sent by an earlier attempt and are not downloaded
+    again, so `part_size` must be a multiple of the stream chunk size.
+    """
+    if part_size % STREAM_CHUNK_SIZE:
+        # Upload parts must not straddle two split parts, and resuming seeks in whole chunks
+        raise ValueError(f"Split part size must be a multiple of {STREAM_CHUNK_SIZE} bytes")
+    file_size = task["file_size"]
+    os.makedirs(spill_dir, exist_ok=True)
+    buffer = ChunkBuffer(buffer_size, os.path.join(spill_dir, f"{chat_id}_{client.rnd_id()}.spill"))
+    offset = first_part * part_size
+
+    async def produce():
+        try:
+            async for chunk in client.stream_media(task["file_id"], offset=offset // STREAM_CHUNK_SIZE):
+                await buffer.put(chunk)
+            buffer.close()
+        except Exception as e:
+            buffer.fail(e)
+            raise
+
+    producer = asyncio.create_task(produce())
+    try:
+        for index in range(first_part, len(names)):
+            start = index * part_size
+            size = min(part_size, file_size - start)
+
+            async def part_progress(current, total, start=start):
+                await report(progress, start + current, file_size)
+
+            input_file = await upload_stream(client, buffer.read, size, names[index], part_progress)
+            message = await send_uploaded_media(
+                client, chat_id, "document", input_file, names[index],
+                caption=f"{caption}\n\nPart {index + 1}/{len(names)}".strip(), thumb_path=thumb_path
+            )
+            if on_part:
+                await on_part(index, message)
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+        buffer.cleanup()
+
+
+async def join_rename(client: Client, parts, chat_id, caption, file_name, thumb_path=None,
+                      buffer_size=64 * 1024 * 1024, spill_dir="downloads", progress=None):
+    """Stream the parts of a split file, given as tasks in order, into one upload.
+
+    The parts are downloaded one after the other into a single ChunkBuffer, so the
+    joined file uploads while its parts are still coming in.
+    """
+    file_size = sum(part["file_size"] for part in parts)
+    os.makedirs(spill_dir, exist_ok=True)
+    buffer = ChunkBuffer(buffer_size, os.path.join(spill_dir, f"{chat_id}_{client.rnd_id()}.spill"))
+
+    async def produce():
+        try:
+            for part in parts:
+                received = 0
+                async for chunk in client.stream_media(part["file_id"]):
+                    await buffer.put(chunk)
+                    received += len(chunk)
+                if received < part["file_size"]:
+                    raise IOError(f"Part ended after {received} of {part['file_size']} bytes")
+            buffer.close()
+        except Exception as e:
+            buffer.fail(e)
+            raise
+
+    producer = asyncio.create_task(produce())
+    try:
+        input_file = await upload_stream(client, buffer.read, file_size, file_name, progress)
+        await producer
+        return await send_uploaded_media(
+            client, chat_id, "document", input_file, file_name,
+            caption=caption, thumb_path=thumb_path
+        )
+    finally:
+        if not producer.done():
+            producer.cancel()
+        buffer.cleanup()
+
+
+async def memory_rename(client: Client, task, chat_id, caption, thumb_path=None, meta=None, progress=None):
+    """Rename a small file without touching the disk.
+
+    The file is downloaded into one preallocated buffer and uploaded again from
+    slices of it; `progress` follows the upload.
+    """
+    file_size = task["file_size"]
+    data = bytearray(file_size)
+    view = memoryview(data)
+    received = 0
+    async for chunk in client.stream_media(task["file_id"]):
+        view[received:received + len(chunk)] = chunk
+        received += len(chunk)
+    if received < file_size:
+        raise IOError(f"Download ended after {received} of {file_size} bytes")
+
+    offset = 0
+
+    async def read_part(size):
+        nonlocal offset
+        chunk = bytes(view[offset:offset + size])
+        offset += len(chunk)
+        return chunk
+
+    input_file = await upload_stream(client, read_part, file_size, task["new_name"], progress)
+    return await send_uploaded_media(
+        client, chat_id, task["file_type"], input_file, task["new_name"],
+        caption=caption, thumb_path=thumb_path, meta=meta
+    )
+
+
+class CdnRedirected(Exception):
+    """The file lives on a CDN DC, which only the sequential downloader supports."""
+
+
+class MediaSessionPool:
+    """Media sessions to each DC, opened on demand and reused across downloads."""
+
+    def __init__(self, client: Client, size=4):
+        self.client = client
+        self.size = size
+        self._sessions = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, dc_id, count=None):
+        """Return `count` (default `size`) started media sessions to a DC."""
+        count = min(count or self.size, self.size)
+        async with self._lock:
+            sessions = self._sessions.setdefault(dc_id, [])
+            while len(sessions) < count:
+                sessions.append(await self._open(dc_id))
+            return sessions[:count]
+
+    async def _open(self, dc_id):
+        client = self.client
+        test_mode = await client.storage.test_mode()
+        if dc_id == await client.storage.dc_id():
+            session = Session(client, dc_id, await client.storage.auth_key(), test_mode, is_media=True)
+            await session.start()
+            return session
+
+        session = Session(client, dc_id, await Auth(client, dc_id, test_mode).create(), test_mode, is_media=True)
+        await session.start()
+        for _ in range(3):
+            exported = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+            try:
+                await session.invoke(raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes))
+                return session
+            except AuthBytesInvalid:
+                continue
+        await session.stop()
+        raise AuthBytesInvalid()
+
+    async def stop(self):
+        for sessions in self._sessions.values():
+            for session in sessions:
+                await session.stop()
+        self._sessions = {}
+
+
+async def parallel_download(pool: MediaSessionPool, file_id, path, file_size, checkpoint, progress=None,
+                            connections=None):
+    """Download a file as 1 MiB ranges fetched concurrently over several media sessions.
+
+    Ranges are written straight to their offset in a preallocated file; finished
+    ranges are recorded in the checkpoint so a retry only fetches the missing ones.
+    """
+    fid = FileId.decode(file_id)
+    location = raw.types.InputDocumentFileLocation(
+        id=fid.media_id,
+        access_hash=fid.access_hash,
+        file_reference=fid.file_reference,
+        thumb_size=""
+    )
+    sessions = await pool.get(fid.dc_id, connections)
+    total_chunks = max(1, math.ceil(file_size / STREAM_CHUNK_SIZE))
+
+    if not os.path.exists(path):
+        checkpoint.download_chunks = set()
+    done = set(checkpoint.download_chunks)
+    todo = iter([i for i in range(total_chunks) if i not in done])
+    downloaded = sum(min(STREAM_CHUNK_SIZE, file_size - i * STREAM_CHUNK_SIZE) for i in done)
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size != file_size:
+            os.ftruncate(fd, file_size)
+        await report(progress, downloaded, file_size)
+
+        async def worker(session):
+            nonlocal downloaded
+            for chunk in todo:
+                r = await session.invoke(
+                    raw.functions.upload.GetFile(
+                        location=location,
+                        offset=chunk * STREAM_CHUNK_SIZE,
+                        limit=STREAM_CHUNK_SIZE
+                    ),
+                    sleep_threshold=30
+                )
+                if isinstance(r, raw.types.upload.FileCdnRedirect):
+                    raise CdnRedirected()
+                await asyncio.to_thread(os.pwrite, fd, r.bytes, chunk * STREAM_CHUNK_SIZE)
+                downloaded += len(r.bytes)
+                checkpoint.download_chunks.add(chunk)
+                if checkpoint.due():
+                    await asyncio.to_thread(os.fsync, fd)
+                    checkpoint.save(force=True)
+                await report(progress, downloaded, file_size)
+
+        workers = [asyncio.create_task(worker(session)) for session in sessions]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await asyncio.to_thread(os.fsync, fd)
+            checkpoint.save(force=True)
+    finally:
+        os.close(fd)
+
+    checkpoint.downloaded = file_size
+    checkpoint.download_complete = True
+    checkpoint.save(force=True)
+    return path
@@ -0,0 +1,51 @@
+from aiohttp import web
+
+
+class WebServer:
+    """HTTP health/status endpoints served on the bot's own event loop.
+
+    `status` returns the /status JSON dict, `ready` is an async check used by the
+    /ready probe, and `metrics` yields lines of text streamed out by /metrics.
+    """
+
+    def __init__(self, port, status, ready, metrics, host="0.0.0.0"):
+        self.port = port
+        self.host = host
+        self.status = status
+        self.ready = ready
+        self.metrics = metrics
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/", self.handle_home)
+        self.app.router.add_get("/status", self.handle_status)
+        self.app.router.add_get("/ready", self.handle_ready)
+        self.app.router.add_get("/metrics", self.handle_metrics)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_home(self, request):
+        return web.Response(text="Bot is running successfully! 🚀")
+
+    async def handle_status(self, request):
+        return web.json_response(self.status())
+
+    async def handle_ready(self, request):
+        ok, detail = await self.ready()
+        return web.json_response({"ready": ok, "detail": detail}, status=200 if ok else 503)
+
+    async def handle_metrics(self, request):
+        response = web.StreamResponse(headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+        await response.prepare(request)
+        for line in self.metrics():
+            await response.write((line + "\n").encode())
+        await response.write_eof()
+        return response
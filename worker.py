@@ -0,0 +1,178 @@
+"""Transfer worker process for WORKER_PROCESSES mode.
+
+Started by worker_pool.WorkerProcess with its index as the only argument. Jobs arrive
+as JSON lines on stdin; status texts, sent file ids, sent split parts and finished jobs
+go back as JSON lines on stdout. Everything else the bot prints is sent to stderr.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+
+
+class RemoteChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class RemoteStatus:
+    """Placeholder for a job's status message, which only exists in the front-end."""
+
+    def __init__(self, job_id):
+        self.chat = RemoteChat(0)
+        self.id = job_id
+
+
+class EventRenderer:
+    """Takes the place of the ProgressRenderer: the newest text of every job is sent
+    to the front-end at most every `interval` seconds, which edits the real message."""
+
+    def __init__(self, emit, interval=0.5):
+        self.emit = emit
+        self.interval = interval
+        self.frames_dropped = 0
+        self._frames = {}
+        self._last_text = {}
+        self._task = None
+
+    def submit(self, message, text):
+        if message.id in self._frames:
+            self.frames_dropped += 1
+        self._frames[message.id] = text
+
+    @property
+    def pending(self):
+        return len(self._frames)
+
+    def flush(self, job_id):
+        """Send the pending text of a job right away."""
+        text = self._frames.pop(job_id, None)
+        if callable(text):
+            text = text()
+        if text and self._last_text.get(job_id) != text:
+            self._last_text[job_id] = text
+            self.emit({"event": "status", "job": job_id, "text": text})
+
+    def forget(self, job_id):
+        self.flush(job_id)
+        self._last_text.pop(job_id, None)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for job_id in list(self._frames):
+                self.flush(job_id)
+
+
+def event_writer(stream):
+    def emit(event):
+        stream.write(json.dumps(event) + "\n")
+        stream.flush()
+    return emit
+
+
+async def serve(index, emit):
+    import bot
+    from pyrogram import Client
+    from transfer import MediaSessionPool
+    from job_queue import JobScheduler
+    from file_cache import SentFileCache
+
+    class ForwardedSentFiles(SentFileCache):
+        """Sent file ids are kept by the front-end, which also does the resends."""
+
+        def get(self, key):
+            return None
+
+        def put(self, key, file_id):
+            if key and file_id:
+                emit({"event": "sent", "key": key, "file_id": file_id})
+
+    client = Client(
+        f"file_renamer_bot_worker_{index}",
+        api_id=bot.API_ID,
+        api_hash=bot.API_HASH,
+        bot_token=bot.BOT_TOKEN,
+        no_updates=True,
+        max_concurrent_transmissions=bot.MAX_TRANSMISSIONS
+    )
+    sessions = MediaSessionPool(client, size=max(bot.DOWNLOAD_CONNECTIONS, bot.UPLOAD_CONNECTIONS))
+    renderer = EventRenderer(emit)
+
+    def forward_parts_sent(job, count):
+        # The front-end stores the job, so a restart continues after the parts already sent
+        job.task["parts_sent"] = count
+        emit({"event": "parts_sent", "job": job.id, "count": count})
+
+    def job_done(job):
+        renderer.forget(job.id)
+        emit({"event": "done", "job": job.id, "status": job.status})
+
+    # process_file finds its collaborators as globals of the bot module
+    bot.app = client
+    bot.media_sessions = sessions
+    bot.client_pool = bot.make_client_pool(client, sessions, bot.make_helper_clients(f"_w{index}"))
+    bot.progress_renderer = renderer
+    bot.sent_files = ForwardedSentFiles({})
+    bot.record_parts_sent = forward_parts_sent
+    bot.scheduler = scheduler = JobScheduler(
+        lambda job: bot.process_file(client, job),
+        workers=bot.WORKERS,
+        max_transmissions=bot.MAX_TRANSMISSIONS * len(bot.client_pool),
+        on_done=job_done
+    )
+
+    await client.start()
+    await bot.client_pool.start()
+    renderer.start()
+    scheduler.start()
+    print(f"Worker {index} ready")
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message["op"] == "run":
+                job = scheduler.submit(message["user_id"], message["task"], RemoteStatus(message["job"]),
+                                       job_id=message["job"])
+                job.created_at = message.get("created_at", time.time())
+            elif message["op"] == "cancel":
+                scheduler.cancel(message["job"])
+            elif message["op"] == "stop":
+                break
+    finally:
+        # Running jobs are interrupted, not cancelled, so their partial files are kept
+        await scheduler.stop()
+        await renderer.stop()
+        await bot.client_pool.stop()
+        await client.stop()
+
+
+def main():
+    index = int(sys.argv[1])
+    # Read by the bot module when it is imported, to give this process its own cache directories
+    os.environ["WORKER_INDEX"] = str(index)
+    # Keep the real stdout for events and send every print to stderr
+    events = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    asyncio.run(serve(index, event_writer(events)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import asyncio
+
+
+class WorkerExited(ConnectionError):
+    """The worker process running a job went away."""
+
+
+class WorkerProcess:
+    """One `worker.py` child process, talking JSON lines over its stdin/stdout."""
+
+    def __init__(self, index, env=None, on_event=None):
+        self.index = index
+        self.env = env
+        self.on_event = on_event
+        self.jobs = {}   # job id -> (future, on_event)
+        self._proc = None
+        self._reader = None
+
+    @property
+    def alive(self):
+        return self._proc is not None and self._proc.returncode is None
+
+    async def start(self):
+        self._proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py"), str(self.index),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=self.env,
+            limit=1024 * 1024
+        )
+        self._reader = asyncio.create_task(self._read())
+
+    async def send(self, message):
+        self._proc.stdin.write(json.dumps(message).encode() + b"\n")
+        await self._proc.stdin.drain()
+
+    async def stop(self, timeout=30):
+        if not self.alive:
+            return
+        try:
+            await self.send({"op": "stop"})
+            await asyncio.wait_for(self._proc.wait(), timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            self._proc.kill()
+            await self._proc.wait()
+        await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def _read(self):
+        while True:
+            line = await self._proc.stdout.readline()
+            if not line:
+                break
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            entry = self.jobs.get(event.get("job"))
+            if not entry:
+                if "job" not in event and self.on_event:
+                    self.on_event(event)
+                continue
+            future, on_event = entry
+            if event["event"] == "done":
+                if not future.done():
+                    future.set_result(event.get("status"))
+            else:
+                on_event(event)
+
+        await self._proc.wait()
+        for future, _ in self.jobs.values():
+            if not future.done():
+                future.set_exception(WorkerExited(f"worker process {self.index} exited ({self._proc.returncode})"))
+
+
+class WorkerPool:
+    """Runs jobs in `size` worker processes, each with its own Telegram session.
+
+    run() sends a job to the least busy worker and resolves when the worker reports
+    it finished; status texts and other events of the job are handed to `on_event`
+    on the way; events that belong to no job go to the pool's `on_event`. Workers
+    that died are restarted when they are picked next.
+    """
+
+    def __init__(self, size, env=None, on_event=None):
+        self.workers = [WorkerProcess(n, env, on_event) for n in range(1, size + 1)]
+
+    def __len__(self):
+        return len(self.workers)
+
+    async def start(self):
+        for worker in self.workers:
+            await worker.start()
+
+    async def stop(self):
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+
+    async def run(self, job_id, payload, on_event, cancelled=lambda: False):
+        """Run a job remotely; `cancelled()` tells a user cancel apart from a shutdown."""
+        worker = min(self.workers, key=lambda w: (not w.alive, len(w.jobs)))
+        if not worker.alive:
+            await worker.start()
+        future = asyncio.get_running_loop().create_future()
+        worker.jobs[job_id] = (future, on_event)
+        try:
+            await worker.send({"op": "run", "job": job_id, **payload})
+            return await future
+        except asyncio.CancelledError:
+            # On shutdown the worker interrupts its jobs itself and keeps their files
+            if cancelled() and worker.alive:
+                await worker.send({"op": "cancel", "job": job_id})
+            raise
+        finally:
+            worker.jobs.pop(job_id, None)
@@ -0,0 +1,143 @@
+import os
+import time
+import shutil
+import asyncio
+from checkpoint import TransferCheckpoint
+
+
+class Workspace:
+    """Private directory of one job under the downloads root.
+
+    The download, its checkpoint and any spill files live in `<root>/<work_id>/`;
+    the renamed file is moved into `out/` with a single rename on the same
+    filesystem, so jobs producing the same final name never touch each other's files.
+    """
+
+    def __init__(self, root, work_id):
+        self.root = root
+        self.work_id = work_id
+        self.path = os.path.join(root, work_id)
+        self.download_path = os.path.join(self.path, "download.part")
+        self.output_dir = os.path.join(self.path, "out")
+
+    def create(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        return self
+
+    @property
+    def checkpoint(self):
+        return TransferCheckpoint(self.download_path + ".ckpt")
+
+    def output_path(self, name):
+        return os.path.join(self.output_dir, name)
+
+    def publish(self, name):
+        """Give the finished download its final name and return the new path.
+
+        A rename within the workspace is atomic and never copies data. Calling it
+        again after a retry finds the already renamed file.
+        """
+        target = self.output_path(name)
+        if os.path.exists(self.download_path):
+            os.replace(self.download_path, target)
+        return target
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def disk_usage(path):
+    """Bytes actually allocated on disk below `path` (sparse preallocations count as used so far)."""
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return getattr(st, "st_blocks", st.st_size // 512) * 512
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            total += getattr(st, "st_blocks", st.st_size // 512) * 512
+    return total
+
+
+class WorkspaceJanitor:
+    """Removes workspaces that no stored job owns anymore, left behind by crashes.
+
+    Orphans older than `grace` seconds are deleted on every sweep; when the downloads
+    root uses more than `max_bytes`, younger orphans go too, oldest first. Workspaces
+    of queued or running jobs (`active()` returns their work ids) are never touched,
+    nor is anything changed in the last `MIN_AGE` seconds, which may belong to a job
+    queued after the sweep started.
+    """
+
+    MIN_AGE = 60
+
+    def __init__(self, root, active, max_bytes=0, grace=3600, interval=600):
+        self.root = root
+        self.active = active
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.interval = interval
+        self.removed = 0
+        self.freed = 0
+        self.usage = 0
+        self._task = None
+
+    async def sweep(self):
+        """Run one cleanup pass and return the number of entries removed."""
+        return await asyncio.to_thread(self._sweep, set(self.active()))
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Workspace cleanup failed: {e}")
+
+    def _sweep(self, active):
+        if not os.path.isdir(self.root):
+            return 0
+        now = time.time()
+        entries = []
+        usage = 0
+        with os.scandir(self.root) as it:
+            for entry in it:
+                size = disk_usage(entry.path)
+                usage += size
+                if entry.name not in active:
+                    entries.append((entry.stat().st_mtime, entry.path, size))
+
+        removed = 0
+        for mtime, path, size in sorted(entries):
+            over_cap = self.max_bytes and usage > self.max_bytes
+            age = now - mtime
+            if age < self.MIN_AGE or (age < self.grace and not over_cap):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+            usage -= size
+            removed += 1
+            self.freed += size
+        self.removed += removed
+        self.usage = usage
+        if self.max_bytes and usage > self.max_bytes:
+            print(f"Downloads use {usage} bytes, above the {self.max_bytes} byte cap, in active jobs")
+        return removed
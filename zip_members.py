@@ -0,0 +1,168 @@
+import os
+import struct
+
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+LOCAL_SIGNATURE = b"PK\x03\x04"
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+END_SIGNATURE = b"PK\x05\x06"
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+UTF8_FLAG = 0x800
+# Info-ZIP Unicode Path field: readers prefer its copy of the name over the renamed one
+UNICODE_PATH_EXTRA = 0x7075
+COPY_SIZE = 1024 * 1024
+
+
+class ZipEntry:
+    """One member as described by the central directory."""
+
+    def __init__(self, fields, name, extra, comment):
+        self.fields = list(fields)
+        self.extra = extra
+        self.comment = comment
+        self.name = name.decode("utf-8" if self.flags & UTF8_FLAG else "cp437")
+        self.new_offset = None
+
+    @property
+    def flags(self):
+        return self.fields[3]
+
+    @property
+    def offset(self):
+        return self.fields[-1]
+
+
+def _encode_name(name):
+    """Name bytes and whether they need the UTF-8 flag, like zipfile writes them."""
+    try:
+        return name.encode("ascii"), False
+    except UnicodeEncodeError:
+        return name.encode("utf-8"), True
+
+
+def _strip_extra(extra, header_id):
+    """Remove all fields with `header_id` from an extra block; malformed tails are kept."""
+    kept = []
+    pos = 0
+    while pos + 4 <= len(extra):
+        field_id, size = struct.unpack_from("<2H", extra, pos)
+        if field_id != header_id:
+            kept.append(extra[pos:pos + 4 + size])
+        pos += 4 + size
+    kept.append(extra[pos:])
+    return b"".join(kept)
+
+
+def _copy(source, target, length):
+    while length > 0:
+        chunk = source.read(min(COPY_SIZE, length))
+        if not chunk:
+            raise ValueError("The archive is truncated")
+        target.write(chunk)
+        length -= len(chunk)
+
+
+def read_central_directory(f):
+    """Entries, archive comment and central directory offset of a ZIP file."""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    tail_size = min(size, END_RECORD.size + 0xFFFF)
+    f.seek(size - tail_size)
+    tail = f.read(tail_size)
+    pos = tail.rfind(END_SIGNATURE)
+    if pos < 0 or tail_size - pos < END_RECORD.size:
+        raise ValueError("Not a ZIP archive")
+    _, disk, directory_disk, _, count, directory_size, directory_offset, comment_size = END_RECORD.unpack_from(tail, pos)
+    comment = tail[pos + END_RECORD.size:pos + END_RECORD.size + comment_size]
+    if disk or directory_disk:
+        raise ValueError("Multi-volume ZIP archives are not supported")
+    if count == 0xFFFF or directory_offset == 0xFFFFFFFF or tail[max(0, pos - 20):pos - 16] == ZIP64_LOCATOR_SIGNATURE:
+        raise ValueError("ZIP64 archives are not supported")
+    if size - tail_size + pos != directory_offset + directory_size:
+        raise ValueError("Archives with data before or inside the ZIP structure are not supported")
+
+    f.seek(directory_offset)
+    directory = f.read(directory_size)
+    entries = []
+    pos = 0
+    for _ in range(count):
+        if directory[pos:pos + 4] != CENTRAL_SIGNATURE:
+            raise ValueError("Corrupt ZIP central directory")
+        fields = CENTRAL_HEADER.unpack_from(directory, pos)
+        name_size, extra_size, member_comment_size = fields[10:13]
+        pos += CENTRAL_HEADER.size
+        name = directory[pos:pos + name_size]
+        extra = directory[pos + name_size:pos + name_size + extra_size]
+        member_comment = directory[pos + name_size + extra_size:pos + name_size + extra_size + member_comment_size]
+        pos += name_size + extra_size + member_comment_size
+        entries.append(ZipEntry(fields, name, extra, member_comment))
+
+    return entries, comment, directory_offset
+
+
+def rename_members(source, target, rename):
+    """Write the ZIP archive `source` to `target` with member names passed through `rename`.
+
+    Only the local headers and the central directory are rewritten: compressed data
+    and data descriptors are copied byte for byte in one sequential pass, nothing is
+    decompressed or extracted. Returns the number of renamed members; raises
+    ValueError for archives it cannot rewrite, and `target` is left untouched then.
+    """
+    partial = os.path.join(os.path.dirname(target), ".partial-" + os.path.basename(target))
+    renamed = 0
+    with open(source, "rb") as src:
+        entries, comment, directory_offset = read_central_directory(src)
+        ordered = sorted(entries, key=lambda e: e.offset)
+        bounds = [e.offset for e in ordered] + [directory_offset]
+        if any(start >= end for start, end in zip(bounds, bounds[1:])):
+            raise ValueError("Corrupt ZIP archive: overlapping members")
+
+        try:
+            with open(partial, "wb") as out:
+                # Anything before the first member, e.g. a spanning marker, is kept as is
+                src.seek(0)
+                _copy(src, out, bounds[0])
+                for entry, end in zip(ordered, bounds[1:]):
+                    header = src.read(LOCAL_HEADER.size)
+                    if header[:4] != LOCAL_SIGNATURE or len(header) < LOCAL_HEADER.size:
+                        raise ValueError(f"Corrupt ZIP local header for `{entry.name}`")
+                    fields = list(LOCAL_HEADER.unpack(header))
+                    src.read(fields[9])
+                    extra = _strip_extra(src.read(fields[10]), UNICODE_PATH_EXTRA)
+                    data_size = end - entry.offset - LOCAL_HEADER.size - fields[9] - fields[10]
+
+                    new_name = entry.name if entry.name.endswith("/") else rename(entry.name)
+                    if new_name != entry.name:
+                        renamed += 1
+                    name, utf8 = _encode_name(new_name)
+                    entry.name = new_name
+                    entry.fields[3] = (entry.flags & ~UTF8_FLAG) | (UTF8_FLAG if utf8 else 0)
+                    fields[2] = entry.fields[3]
+                    fields[9], fields[10] = len(name), len(extra)
+
+                    entry.new_offset = out.tell()
+                    out.write(LOCAL_HEADER.pack(*fields) + name + extra)
+                    _copy(src, out, data_size)
+
+                new_directory_offset = out.tell()
+                for entry in entries:
+                    name, _ = _encode_name(entry.name)
+                    extra = _strip_extra(entry.extra, UNICODE_PATH_EXTRA)
+                    entry.fields[10:13] = [len(name), len(extra), len(entry.comment)]
+                    entry.fields[-1] = entry.new_offset
+                    out.write(CENTRAL_HEADER.pack(*entry.fields) + name + extra + entry.comment)
+                directory_size = out.tell() - new_directory_offset
+                if new_directory_offset + directory_size > 0xFFFFFFFF:
+                    raise ValueError("The renamed archive would need ZIP64")
+                out.write(END_RECORD.pack(
+                    END_SIGNATURE, 0, 0, len(entries), len(entries),
+                    directory_size, new_directory_offset, len(comment)
+                ) + comment)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+    os.replace(partial, target)
+    return renamed